@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# Generate a synthetic datanova CSV (data/laposte_ouvertur.csv), the matching Overpass XML
+# (data/osm_post_offices.xml) and a saved_opening_hours file, at any scale, for benchmarking.
+# The post offices use the patterns parse.pl knows about: alternating weeks, Nth weekday of
+# the month, one-month exceptions, single-day closures, closed offices, public holidays.
+# On the OSM side there are offices with and without opening_hours, covid tags,
+# duplicate refs and refs that are not in datanova.
+import argparse
+import datetime
+import os
+import random
+import sys
+from xml.sax.saxutils import quoteattr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from opening_hours_rules import public_holidays
+
+header = ['#Identifiant', 'Libellé_du_site', 'Date_calendrier',
+          'Plage_horaire_1', 'Plage_horaire_2', 'Plage_horaire_3', 'Plage_horaire_4',
+          'Plage_horaire_5', 'Plage_horaire_6', 'Plage_horaire_7',
+          'Heure_limite_dépôt_Courrier', 'Heure_limite_dépôt_Chrono', 'Heure_limite_dépôt_Colis',
+          'Libellé_de_la_fermeture',
+          'Bp_Plage_horaire_1', 'Bp_Plage_horaire_2', 'Bp_Plage_horaire_3', 'Bp_Plage_horaire_4',
+          'Bp_Plage_horaire_5', 'Bp_Plage_horaire_6', 'Bp_Plage_horaire_7', 'Bp_Libellé_de_la_fermeture']
+
+patterns = ['regular', 'alternating_weeks', 'nth_weekday', 'month_exception', 'closures', 'closed']
+
+mornings = ['08:30-12:00', '09:00-12:00', '09:00-12:30', '09:15-11:45', '10:00-12:00']
+afternoons = ['13:30-16:30', '13:30-17:00', '14:00-16:30', '14:00-17:00', '14:00-18:00']
+names = ['AMBERIEU', 'AVIGNON', 'BOISSE', 'CHAVIGNON', 'LYON', 'MARSEILLE', 'NANTES', 'PARIS', 'RENNES', 'TOULOUSE']
+suffixes = ['BP', 'AP', 'RP', 'CENTRE', 'GARE', 'REPUBLIQUE']
+
+# The opening hours of one office on one day, as a list of up to 3 ranges, or [] if closed
+def opening_for(office, day, holidays):
+    pattern = office['pattern']
+    if pattern == 'closed' or day in holidays:
+        return []
+    weekday = day.isoweekday()
+    if weekday == 7:
+        return []
+    if weekday == 6:
+        if pattern == 'alternating_weeks' and day.isocalendar()[1] % 2 == office['parity']:
+            return []
+        if pattern == 'nth_weekday' and (day.day - 1) // 7 + 1 != office['nth']:
+            return []
+        return [office['saturday']]
+    if pattern == 'closures' and day in office['closures']:
+        return []
+    if pattern == 'month_exception' and day.month == office['month']:
+        return [office['exception']]
+    return office['week']
+
+def make_office(rng, number, start, days):
+    office = {
+        'id': '{0:05d}A'.format(number),
+        'name': '{0} {1} {2}'.format(rng.choice(names), number, rng.choice(suffixes)),
+        'pattern': rng.choice(patterns),
+        'week': [rng.choice(mornings), rng.choice(afternoons)] if rng.random() < 0.8 else [rng.choice(mornings)],
+        'saturday': rng.choice(mornings),
+        'parity': rng.randint(0, 1),
+        'nth': rng.randint(1, 4),
+        'month': (start + datetime.timedelta(days=rng.randint(35, max(35, days - 1)))).month,
+        'exception': rng.choice(mornings),
+        'closures': set(start + datetime.timedelta(days=rng.randint(0, days - 1)) for i in range(rng.randint(1, 3))),
+        'lat': rng.uniform(42.5, 51.0),
+        'lon': rng.uniform(-4.5, 8.0),
+    }
+    return office
+
+def write_csv(filename, offices, start, days, encoding):
+    holidays = public_holidays(start.year) | public_holidays(start.year + 1)
+    with open(filename, 'w', encoding=encoding, newline='') as f:
+        f.write(';'.join(header) + '\r\n')
+        for office in offices:
+            for i in range(days):
+                day = start + datetime.timedelta(days=i)
+                opening = opening_for(office, day, holidays)
+                ranges = (opening + ['', '', ''])[:3] if opening else ['FERME', '', '']
+                row = [office['id'], office['name'], day.strftime('%d/%m/%Y')] + ranges + [''] * 4 + \
+                      ['16:00', '16:00', '16:00', ''] + (['FERME'] if not opening else ranges[:1]) + [''] * 7
+                f.write(';'.join(row) + '\r\n')
+
+def guess_rule(office):
+    rule = 'Mo-Fr ' + ','.join(office['week']) + '; Sa ' + office['saturday'] + '; PH off'
+    return rule
+
+def write_osm(filename, rng, offices, covid_ratio, duplicate_ratio, unknown_ratio, hours_ratio):
+    with open(filename, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<osm version="0.6" generator="generate_synthetic.py">\n')
+        f.write('  <meta osm_base="2024-01-01T00:00:00Z"/>\n')
+        objects = [(office['id'], office) for office in offices]
+        objects += [(office['id'], office) for office in offices if rng.random() < duplicate_ratio]
+        objects += [('{0:05d}X'.format(i), offices[i % len(offices)]) for i in range(int(len(offices) * unknown_ratio))]
+        for number, (ref, office) in enumerate(objects, start=1):
+            tags = [('amenity', 'post_office'), ('name', 'La Poste ' + office['name']), ('ref:FR:LaPoste', ref)]
+            if rng.random() < hours_ratio:
+                tags.append(('opening_hours', guess_rule(office)))
+            if rng.random() < covid_ratio:
+                tags.append(('opening_hours:covid19', 'Mo-Fr 10:00-12:00'))
+            timestamp = '2019-06-01T00:00:00Z' if rng.random() < 0.5 else '2022-06-01T00:00:00Z'
+            lat = office['lat'] + rng.uniform(-0.01, 0.01)
+            lon = office['lon'] + rng.uniform(-0.01, 0.01)
+            common = ' version="{0}" timestamp="{1}" changeset="1" uid="1" user="synthetic"'.format(rng.randint(1, 9), timestamp)
+            if number % 10 == 0:
+                f.write('  <way id="{0}"{1}>\n'.format(number, common))
+                f.write('    <center lat="{0:.7f}" lon="{1:.7f}"/>\n'.format(lat, lon))
+                f.write('    <nd ref="{0}"/>\n'.format(number * 10))
+            else:
+                f.write('  <node id="{0}" lat="{1:.7f}" lon="{2:.7f}"{3}>\n'.format(number, lat, lon, common))
+            for k, v in tags:
+                f.write('    <tag k={0} v={1}/>\n'.format(quoteattr(k), quoteattr(v)))
+            f.write('  </way>\n' if number % 10 == 0 else '  </node>\n')
+        f.write('</osm>\n')
+
+def write_saved(filename, rng, offices, saved_ratio):
+    with open(filename, 'w') as f:
+        for office in offices:
+            if rng.random() < saved_ratio:
+                f.write(office['id'] + '|' + office['name'] + '|' + guess_rule(office) + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic datanova and OSM data')
+    parser.add_argument('--offices', type=int, default=1000, help='number of post offices (default: 1000)')
+    parser.add_argument('--days', type=int, default=90, help='number of days in the CSV (default: 90)')
+    parser.add_argument('--start', help='first day, YYYY-MM-DD (default: today)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--encoding', default='latin1', help='encoding of the CSV (default: latin1, like datanova)')
+    parser.add_argument('--covid', type=float, default=0.05, help='ratio of OSM objects with opening_hours:covid19')
+    parser.add_argument('--duplicates', type=float, default=0.01, help='ratio of refs used twice in OSM')
+    parser.add_argument('--unknown', type=float, default=0.01, help='ratio of OSM refs that are not in datanova')
+    parser.add_argument('--with-hours', type=float, default=0.3, help='ratio of OSM objects that already have opening_hours')
+    parser.add_argument('--saved', type=float, default=0.2, help='ratio of offices in saved_opening_hours')
+    parser.add_argument('outdir', help='where to create data/ and saved_opening_hours')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    start = datetime.date.fromisoformat(args.start) if args.start else datetime.date.today()
+    offices = [make_office(rng, number, start, args.days) for number in range(1, args.offices + 1)]
+
+    os.makedirs(os.path.join(args.outdir, 'data'), exist_ok=True)
+    write_csv(os.path.join(args.outdir, 'data', 'laposte_ouvertur.csv'), offices, start, args.days, args.encoding)
+    write_osm(os.path.join(args.outdir, 'data', 'osm_post_offices.xml'), rng, offices,
+              args.covid, args.duplicates, args.unknown, args.with_hours)
+    write_saved(os.path.join(args.outdir, 'saved_opening_hours'), rng, offices, args.saved)
+
+if __name__ == '__main__':
+    main()
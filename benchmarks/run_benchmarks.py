@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Time each stage of the import pipeline on synthetic data (see generate_synthetic.py),
+# record wall time, CPU time and peak RSS of each stage into a JSON report,
+# and optionally compare with the report of a previous commit.
+import argparse
+import datetime
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(script_dir)
+
+def stages(workdir):
+    return [
+        ('parse', [os.path.join(repo_dir, 'parallel_parse.py'), '--cache', '',
+                   'data/laposte_ouvertur.csv', 'data/new_opening_hours', 'data/warnings']),
+        ('process_post_offices', [os.path.join(repo_dir, 'process_post_offices.py')]),
+        ('filter_changes', [os.path.join(repo_dir, 'filter_changes.py')]),
+        ('commit_changes_locally', lambda: [os.path.join(repo_dir, 'commit_changes_locally.py')] +
+                                           sorted(glob.glob(os.path.join(workdir, 'changes', '*.hours')))),
+    ]
+
+# Run one stage, returning its measurements. The rusage from wait4 covers the stage
+# and the processes it waited for (e.g. the parse.pl processes).
+def run_stage(command, workdir, log):
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+    pid, status, rusage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        'wall': round(wall, 3),
+        'cpu': round(rusage.ru_utime + rusage.ru_stime, 3),
+        'max_rss_kb': rusage.ru_maxrss,
+        'returncode': process.returncode,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_dir, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+def run(args):
+    report = {
+        'commit': git_commit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'params': {'offices': args.offices, 'days': args.days, 'seed': args.seed},
+        'stages': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='bench_') as tmpdir:
+        workdir = args.workdir or tmpdir
+        subprocess.run([sys.executable, os.path.join(script_dir, 'generate_synthetic.py'),
+                        '--offices', str(args.offices), '--days', str(args.days), '--seed', str(args.seed),
+                        workdir], check=True)
+        with open(os.path.join(workdir, 'benchmark.log'), 'w') as log:
+            for name, command in stages(workdir):
+                if callable(command):
+                    command = command()
+                result = run_stage(command, workdir, log)
+                report['stages'][name] = result
+                print('{0:24} wall {1:8.2f}s  cpu {2:8.2f}s  peak RSS {3:8d} KB{4}'.format(
+                      name, result['wall'], result['cpu'], result['max_rss_kb'],
+                      '' if result['returncode'] == 0 else '  FAILED, see ' + os.path.join(workdir, 'benchmark.log')))
+                if result['returncode'] != 0:
+                    break # the next stages need this one's output
+    return report
+
+# Returns the list of regressions: stage, metric, old value, new value
+def compare(old, new, threshold):
+    regressions = []
+    for name, result in new['stages'].items():
+        if name not in old['stages'] or result['returncode'] != 0 or old['stages'][name]['returncode'] != 0:
+            continue
+        for metric in ('wall', 'cpu', 'max_rss_kb'):
+            before = old['stages'][name][metric]
+            after = result[metric]
+            ratio = after / before if before > 0 else 1
+            print('{0:24} {1:10} {2:12} -> {3:12} ({4:+.0%})'.format(name, metric, before, after, ratio - 1))
+            if ratio > threshold:
+                regressions.append((name, metric, before, after))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the import pipeline on synthetic data')
+    parser.add_argument('--offices', type=int, default=1000, help='number of post offices (default: 1000)')
+    parser.add_argument('--days', type=int, default=90, help='number of days in the CSV (default: 90)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', help='keep the generated data and outputs there, instead of a temporary directory')
+    parser.add_argument('--report', default='benchmark.json', help='where to write the JSON report (default: benchmark.json)')
+    parser.add_argument('--compare', help='JSON report from a previous run, to detect regressions')
+    parser.add_argument('--threshold', type=float, default=1.25, help='max allowed ratio new/old before reporting a regression (default: 1.25)')
+    args = parser.parse_args()
+
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+    report = run(args)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if old['params'] != report['params']:
+            print('WARNING: comparing runs with different parameters: {0} vs {1}'.format(old['params'], report['params']))
+        regressions = compare(old, report, args.threshold)
+        for name, metric, before, after in regressions:
+            print('REGRESSION: {0} {1}: {2} -> {3}'.format(name, metric, before, after))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
-import os
 import sys
+import rule_files
+from opening_hours_store import SavedOpeningHours
 
 if len(sys.argv) < 2:
     sys.stderr.write("Synopsis:\n")
@@ -12,39 +13,12 @@ for arg in sys.argv[1:]:
     # There's room for adding support for options here
     filenames.append(arg)
 
-# parse office id -> office name dict, to keep .hours files readable
-office_names = {}
-with open('data/new_opening_hours') as f:
-    for line in f.readlines():
-        data = [item.strip() for item in line.split('|')]
-        office_names[data[0]] = data[1]
-
 # Our local DB
-local_db = 'saved_opening_hours'
-
-hours_dict = {}
-with open(local_db) as f:
-    for line in f.readlines():
-        data = [item.strip() for item in line.split('|')]
-        if len(data) < 3:
-            print("ERROR: invalid line " + line)
-        else:
-            id = data[0]
-            hours_dict[id] = data[2]
-            if id not in office_names:
-                office_names[id] = data[1]
-            #print("DB " + id)
+store = SavedOpeningHours('saved_opening_hours')
 
-# Merge the newly uploaded files into the DB
-for hours_file in filenames:
-    with open(hours_file) as f:
-        for line in f.readlines():
-            data = [item.strip() for item in line.split('|')]
-            hours_dict[data[0]] = data[2]
-            #print(hours_file + " " + data[0])
+# Append the newly uploaded files to the journal
+store.commit(filenames)
 
-# Save back the DB
-with open(local_db + ".new", "w") as f:
-    for ref in sorted(hours_dict.keys()):
-        f.write(ref + "|" + office_names[ref] + "|" + hours_dict[ref] + "\n")
-os.rename(local_db + ".new", local_db)
+# Merge the journal back into the DB right away, with the current office names, to keep it readable.
+# A journal left over by an interrupted run is merged in at the same time.
+store.compact(rule_files.load('data/new_opening_hours', report_invalid=False).names_dict())
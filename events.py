@@ -0,0 +1,35 @@
+# Machine-readable log of what each stage did, one JSON object per line:
+#   {"stage": "process_post_offices", "ref": "00001A", "object": "node/123", "decision": "added", "changed": true}
+#   {"stage": "filter_changes", "chunks": 12, ...}
+#   {"stage": "process_post_offices", "timing": {"wall": 1.2, "cpu": 1.1, "max_rss_kb": 51200}}
+# summarize_events.py turns that into data/stats.
+import json
+import resource
+import time
+
+class EventLog:
+    def __init__(self, filename, stage, mode='a'):
+        self.file = open(filename, mode)
+        self.stage = stage
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+    def write(self, record):
+        record = dict(stage=self.stage, **record)
+        self.file.write(json.dumps(record) + '\n')
+
+    # One record per OSM object handled by process_post_offices.py
+    def decision(self, ref, decision, object, changed, duplicate):
+        record = {'ref': ref, 'object': object, 'decision': decision, 'changed': changed}
+        if duplicate:
+            record['duplicate'] = True
+        self.write(record)
+
+    # Writes the timing of the stage, and closes the log
+    def close(self):
+        self.write({'timing': {
+            'wall': round(time.perf_counter() - self.start_wall, 3),
+            'cpu': round(time.process_time() - self.start_cpu, 3),
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }})
+        self.file.close()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# Download the datanova CSV only if it changed (ETag / If-Modified-Since),
+# resuming a previous partial download if any (Range), transcoding it from latin1
+# to utf8 on the fly. The output file is only replaced once the download is complete.
+import argparse
+import http.client
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+
+default_url = 'https://datanova.laposte.fr/data-fair/api/v1/datasets/laposte-ouvertur/raw'
+
+chunk_size = 1024 * 1024
+
+def read_meta(filename):
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+def write_meta(filename, meta):
+    with open(filename + '.new', 'w') as f:
+        json.dump(meta, f)
+    os.rename(filename + '.new', filename)
+
+# Number of latin1 bytes already downloaded into the utf8 .part file.
+# latin1 characters become 1 or 2 bytes in utf8, the 2-byte ones start with \xc2 or \xc3.
+def downloaded_size(part):
+    size = 0
+    with open(part, 'r+b') as f:
+        # Drop a character that was only half written
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) in (b'\xc2', b'\xc3'):
+                f.truncate(f.tell() - 1)
+        f.seek(0)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk) - chunk.count(b'\xc2') - chunk.count(b'\xc3')
+    return size
+
+def validators(response):
+    meta = {}
+    if response.headers.get('ETag'):
+        meta['etag'] = response.headers['ETag']
+    if response.headers.get('Last-Modified'):
+        meta['last_modified'] = response.headers['Last-Modified']
+    return meta
+
+# Returns True if the file was downloaded, False if it didn't change
+def fetch(url, output, timeout=600):
+    meta_file = output + '.meta'
+    part = output + '.part'
+    part_meta_file = part + '.meta'
+
+    request = urllib.request.Request(url)
+    offset = 0
+    part_meta = read_meta(part_meta_file)
+    if os.path.isfile(part) and part_meta:
+        # Resume, unless the file changed on the server meanwhile
+        offset = downloaded_size(part)
+        request.add_header('Range', 'bytes={0}-'.format(offset))
+        request.add_header('If-Range', part_meta.get('etag') or part_meta.get('last_modified'))
+    elif os.path.isfile(output):
+        meta = read_meta(meta_file)
+        if 'etag' in meta:
+            request.add_header('If-None-Match', meta['etag'])
+        if 'last_modified' in meta:
+            request.add_header('If-Modified-Since', meta['last_modified'])
+
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return False
+        if e.code == 416: # nothing left to download? start again
+            os.remove(part)
+            os.remove(part_meta_file)
+            return fetch(url, output, timeout)
+        raise
+
+    with response:
+        if response.status == 206:
+            mode = 'ab'
+        else:
+            mode = 'wb'
+            offset = 0
+            part_meta = validators(response)
+            write_meta(part_meta_file, part_meta)
+        incomplete = False
+        with open(part, mode) as f:
+            f.seek(0, os.SEEK_END)
+            while not incomplete:
+                try:
+                    chunk = response.read(chunk_size)
+                except http.client.IncompleteRead as e:
+                    chunk = e.partial # keep what we got, for the next run to resume from
+                    incomplete = True
+                if not chunk:
+                    break
+                f.write(chunk.decode('latin1').encode('utf-8'))
+                offset += len(chunk)
+
+    expected = None
+    content_range = response.headers.get('Content-Range')
+    if content_range and '/' in content_range and not content_range.endswith('/*'):
+        expected = int(content_range.split('/')[1])
+    elif response.status == 200 and response.headers.get('Content-Length'):
+        expected = int(response.headers['Content-Length'])
+    # Chunked responses have no length to check against, rely on IncompleteRead then
+    if incomplete and expected is None:
+        raise IOError('Incomplete download: connection lost after {0} bytes, run again to resume'.format(offset))
+    if incomplete or (expected is not None and offset != expected):
+        raise IOError('Incomplete download: got {0} bytes out of {1}, run again to resume'.format(offset, expected))
+
+    os.replace(part, output)
+    write_meta(meta_file, part_meta)
+    os.remove(part_meta_file)
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description='Download the datanova CSV if it changed, as utf8')
+    parser.add_argument('--url', default=default_url)
+    parser.add_argument('output', nargs='?', default='data/laposte_ouvertur.csv')
+    args = parser.parse_args()
+    try:
+        if fetch(args.url, args.output):
+            print("Downloaded " + args.output)
+        else:
+            print(args.output + " is up to date")
+    except (IOError, urllib.error.URLError) as e:
+        sys.stderr.write("ERROR: {0}\n".format(e))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
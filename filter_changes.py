@@ -1,122 +1,187 @@
 #!/usr/bin/env python3
 import os
-import subprocess
 import shutil
-import copy
+import sys
 import math
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from events import EventLog
+from upload_changes import UploadJournal, default_journal
+import rule_files
 
-# Parse office id -> office name dict, to keep .hours files readable
-office_names = {}
-with open('data/new_opening_hours') as f:
-    for line in f.readlines():
-        data = [item.strip() for item in line.split('|')]
-        office_names[data[0]] = data[1]
+events = EventLog('data/events.jsonl', 'filter_changes')
 
-# Prepare output dir
+# office id -> office name, to keep .hours files readable
+office_names = rule_files.load('data/new_opening_hours', report_invalid=False).names_dict()
+
+# Prepare output dir, unless it still has changesets uploaded but not committed to saved_opening_hours
+# (their .hours files would be lost, and the next import would see them as modified by a human)
 if os.path.exists('changes'):
+    not_committed = UploadJournal(default_journal).not_committed()
+    if len(not_committed) > 0:
+        print("ERROR: {0} changesets in changes/ were uploaded but not committed, run ./upload_changes.py commit first".format(len(not_committed)))
+        # Still end this run in the event log, or the summary would show the previous run
+        events.write({'error': '{0} changesets uploaded but not committed'.format(len(not_committed))})
+        events.close()
+        sys.exit(1)
     shutil.rmtree('changes')
 os.mkdir('changes')
 
 class CurrentOutput:
     file_counter = 0           # C++ static
     object_counter = 0         # C++ static
-    def __init__(self, root, prefix):
+    def __init__(self, prefix):
         self.hours_out = 'changes/' + prefix + str(CurrentOutput.file_counter) + '.hours'
-        self.my_file_counter = CurrentOutput.file_counter
-        self.hours_file = open(self.hours_out, 'w')
-        self.xmlroot = ET.Element(root.tag)
-        self.xmlroot.attrib = copy.deepcopy(root.attrib)
+        self.osc_out = 'changes/' + prefix + str(CurrentOutput.file_counter) + '.osc'
+        self.hours_lines = []
+        # An osmChange document with all the objects in one <modify> block, as uploaded by upload_changes.py
+        self.oscroot = ET.Element('osmChange', {'version': '0.6', 'generator': 'filter_changes.py'})
+        self.modify = ET.SubElement(self.oscroot, 'modify')
         self.count = 0
 
-    def write_and_close(self, prefix):
-        self.hours_file.close()
-        if self.count > 0:
-            CurrentOutput.object_counter += self.count
-            osm_out = 'changes/' + prefix + str(self.my_file_counter) + '.osm'
-            ET.ElementTree(self.xmlroot).write(osm_out, 'unicode', True)
-            # Create the corresponding ".osc" file
-            subprocess.call(["python3", "../osm-bulk-upload/osm2change.py", osm_out])
-            CurrentOutput.file_counter += 1
+    # Can be called from a worker thread, it only touches this chunk's objects
+    def write_and_close(self):
+        with open(self.hours_out, 'w') as hours_file:
+            hours_file.writelines(self.hours_lines)
+        # The objects still have the whitespace of data/osm_post_offices.osm around them
+        ET.indent(self.oscroot, '  ')
+        ET.ElementTree(self.oscroot).write(self.osc_out, 'utf-8')
 
     def keep(self, child):
         #ref = child.find("./tag[@k='ref:FR:LaPoste']").get('v')
         #return ref == '15854A'
         return True
 
-    def add(self, child, ref, office_name):
-        # https://stackoverflow.com/questions/15527399/python-elementtree-inserting-a-copy-of-an-element
-        self.xmlroot.append(ET.ElementTree(child).getroot())
-        self.hours_file.write(ref + "|" + office_name + "|" + opening_hours + "\n")
+    def add(self, child, ref, office_name, opening_hours):
+        child.attrib.pop('action')
+        self.modify.append(child)
+        self.hours_lines.append(ref + "|" + office_name + "|" + opening_hours + "\n")
         self.count += 1
 
-    def enlarge_area(self, child, office_name):
-        lat_str = child.get('lat')
-        lon_str = child.get('lon')
-        if lat_str is None or lon_str is None:
-            center = child.find("center")
-            if center is None:
-                print('No lat/lon nor center for id ' + child.get('id'))
-            lat_str = center.get('lat')
-            lon_str = center.get('lon')
-        if lat_str is None or lon_str is None:
-            print('Missing lat/lon for id ' + child.get('id'))
-        #print('{}, {}, {}'.format(office_name, lat_str, lon_str))
-        lat = float(lat_str)
-        lon = float(lon_str)
-        if self.count == 0:
-            self.min_lat = lat
-            self.max_lat = lat
-            self.min_lon = lon
-            self.max_lon = lon
+def position(child):
+    lat_str = child.get('lat')
+    lon_str = child.get('lon')
+    if lat_str is None or lon_str is None:
+        center = child.find("center")
+        if center is None:
+            print('No lat/lon nor center for id ' + child.get('id'))
+        lat_str = center.get('lat')
+        lon_str = center.get('lon')
+    if lat_str is None or lon_str is None:
+        print('Missing lat/lon for id ' + child.get('id'))
+    return float(lat_str), float(lon_str)
+
+# area = (2*pi)*R^2 |sin(lat1)-sin(lat2)| |lon1-lon2| / 360
+# http://mathforum.org/library/drmath/view/63767.html
+# For a more precise version, consider https://stackoverflow.com/a/61176787
+def area(min_lat, max_lat, min_lon, max_lon): # in km^2
+    size = math.pi * 2 * 6357 * 6357 * abs(math.sin(math.radians(max_lat)) - math.sin(math.radians(min_lat))) * abs(max_lon - min_lon) / 360
+    #print('  lat {} - {}, lon {} - {} => area {}'.format(min_lat, max_lat, min_lon, max_lon, size))
+    return size
+
+# Limits for one changeset
+max_area = 5000 # km^2
+max_objects = 2000
+
+def bbox(items):
+    lats = [item[0] for item in items]
+    lons = [item[1] for item in items]
+    return min(lats), max(lats), min(lons), max(lons)
+
+# Split a list of modified objects into chunks, each one within max_area and max_objects,
+# by recursively cutting the bounding box in two (k-d tree).
+# Each item is (lat, lon, key, ...), the key makes the order (and therefore the chunks) deterministic.
+def split(items):
+    box = bbox(items)
+    too_large = area(*box) > max_area
+    if not too_large and len(items) <= max_objects:
+        return [items]
+    best = None
+    if too_large:
+        # Cut in the middle of the latitude or longitude range, whichever leaves
+        # the smallest total area, to avoid creating chunks that are too small
+        for axis in (0, 1):
+            low, high = box[2 * axis], box[2 * axis + 1]
+            middle = (low + high) / 2
+            halves = [[item for item in items if item[axis] <= middle], [item for item in items if item[axis] > middle]]
+            if len(halves[0]) == 0 or len(halves[1]) == 0:
+                continue # all the items on the same side: low == high, or the middle rounded to high
+            total_area = area(*bbox(halves[0])) + area(*bbox(halves[1]))
+            if best is None or total_area < best[0]:
+                best = (total_area, halves)
+    if best is not None:
+        parts = best[1]
+    else:
+        # Small enough (or can't be cut), just too many objects: cut into as few slices as possible
+        items = sorted(items, key=lambda item: (item[0], item[1], item[2]))
+        num_slices = math.ceil(len(items) / max_objects)
+        if num_slices == 1:
+            return [items]
+        size = math.ceil(len(items) / num_slices)
+        parts = [items[i:i + size] for i in range(0, len(items), size)]
+    chunks = []
+    for part in parts:
+        chunks += split(part)
+    return chunks
+
+# The cuts above are made without looking at the other side, so many small chunks end up
+# next to each other. Merge each chunk into the previous one (its neighbour in the k-d tree)
+# as long as the result stays within both limits.
+def partition(items):
+    chunks = []
+    for chunk in split(items):
+        if len(chunks) > 0 and len(chunks[-1]) + len(chunk) <= max_objects and area(*bbox(chunks[-1] + chunk)) <= max_area:
+            chunks[-1] = chunks[-1] + chunk
         else:
-            self.min_lat = min(self.min_lat, lat)
-            self.max_lat = max(self.max_lat, lat)
-            self.min_lon = min(self.min_lon, lon)
-            self.max_lon = max(self.max_lon, lon)
-
-    # area = (2*pi)*R^2 |sin(lat1)-sin(lat2)| |lon1-lon2| / 360
-    # http://mathforum.org/library/drmath/view/63767.html
-    # For a more precise version, consider https://stackoverflow.com/a/61176787
-    def area(self): # in km^2
-        size = math.pi * 2 * 6357 * 6357 * abs(math.sin(math.radians(self.max_lat)) - math.sin(math.radians(self.min_lat))) * abs(self.max_lon - self.min_lon) / 360
-        #print('  lat {} - {}, lon {} - {} => area {}'.format(self.min_lat, self.max_lat, self.min_lon, self.max_lon, size))
-        return size
+            chunks.append(chunk)
+    return chunks
+
+_items = [(45.0, 5.0, 'node/1'), (45.0, 5.1, 'node/2'), (45.1, 5.0, 'node/3'), (43.3, 5.4, 'node/4'), (48.8, 2.3, 'node/5')]
+assert [[item[2] for item in chunk] for chunk in partition(_items)] == [['node/4'], ['node/1', 'node/2', 'node/3'], ['node/5']]
 
 # open the full output from process_post_offices.py
 tree = ET.parse('data/osm_post_offices.osm')
 root = tree.getroot()
 
-current_out_dict = {}
-
+# Collect the modified objects, grouped by reason
+items_for_reason = {}
 for child in root:
     if (child.tag == 'node' or child.tag == 'way') and child.get('action') == 'modify':
         reason = child.get('X-reason', '') # set by process_post_offices.py
         if reason != '':
             child.attrib.pop('X-reason')
-        if not reason in current_out_dict:
-            current_out_dict[reason] = CurrentOutput(root, reason)
-        current_out = current_out_dict[reason]
-        if current_out.keep(child):
-            ref = child.find("./tag[@k='ref:FR:LaPoste']").get('v')
-            opening_hours = child.find("./tag[@k='opening_hours']").get('v')
-            office_name = ''
-            if ref in office_names:
-                office_name = office_names[ref]
-
-            current_out.enlarge_area(child, office_name)
-            if current_out.area() > 5000: # km^2
-                current_out.write_and_close(reason)
-                #print('starting new chunk')
-                current_out_dict[reason] = CurrentOutput(root, reason)
-                current_out = current_out_dict[reason]
-                current_out.enlarge_area(child, office_name) # initialize with this one
-            current_out.add(child, ref, office_name)
-
-for reason, current_out in current_out_dict.items():
-    current_out.write_and_close(reason)
+        lat, lon = position(child)
+        items_for_reason.setdefault(reason, []).append((lat, lon, child.tag + '/' + child.get('id'), child))
+
+# Write the .hours and .osc files of all chunks in parallel
+with ThreadPoolExecutor() as executor:
+    futures = []
+    for reason in sorted(items_for_reason.keys()):
+        chunks = partition(items_for_reason[reason])
+        sizes = sorted(len(chunk) for chunk in chunks)
+        print("{0}: {1} object(s) in {2} chunk(s), chunk sizes: min {3}, median {4}, max {5}".format(
+              reason if reason != '' else 'new', sum(sizes), len(chunks), sizes[0], sizes[len(sizes) // 2], sizes[-1]))
+        events.write({'reason': reason, 'objects': sum(sizes), 'chunks': len(chunks), 'chunk_sizes': sizes})
+        for chunk in chunks:
+            current_out = CurrentOutput(reason)
+            for lat, lon, key, child in chunk:
+                if current_out.keep(child):
+                    ref = child.find("./tag[@k='ref:FR:LaPoste']").get('v')
+                    opening_hours = child.find("./tag[@k='opening_hours']").get('v')
+                    office_name = ''
+                    if ref in office_names:
+                        office_name = office_names[ref]
+                    current_out.add(child, ref, office_name, opening_hours)
+            if current_out.count > 0:
+                CurrentOutput.object_counter += current_out.count
+                CurrentOutput.file_counter += 1
+                futures.append(executor.submit(current_out.write_and_close))
+    for future in futures:
+        future.result() # raise any error
 
 if CurrentOutput.file_counter == 0:
     print("nothing to upload")
 else:
     print(str(CurrentOutput.file_counter) + " file(s) created, to upload changes to " + str(CurrentOutput.object_counter) + " object(s)")
+
+events.close()
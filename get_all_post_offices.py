@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
-# https://github.com/mvexel/overpass-api-python-wrapper
-import overpass
+# Fetch all post offices with a ref:FR:LaPoste via Overpass, into data/osm_post_offices.xml
+# By default only the objects changed since the last fetch are downloaded, use --full to download everything again.
+import sys
+from overpass_cache import OverpassCache, OverpassError
 
-api = overpass.API(timeout=3000)
+full = '--full' in sys.argv[1:]
 
-# https://wiki.openstreetmap.org/wiki/Overpass_API/Language_Guide#The_Overpass_API_languages
-response = api.get('nwr["ref:FR:LaPoste"]["amenity"="post_office"]', responseformat="xml", verbosity='meta center qt')
-
-xmlfile = open("data/osm_post_offices.xml", "w+")
-xmlfile.write(response)
+cache = OverpassCache('data/osm_post_offices_cache.json')
+try:
+    downloaded, removed = cache.update(full)
+except OverpassError as e:
+    print("ERROR: {0}, the cache is left as it was".format(e))
+    sys.exit(1)
+print("Overpass: {0} object(s) downloaded, {1} removed, {2} post offices in total".format(downloaded, removed, len(cache.elements)))
+cache.save()
+cache.write_xml('data/osm_post_offices.xml')
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# Which post offices are open at a given time, or closed during a given period?
+# Each distinct rule is expanded once (see opening_hours_rules.day_hours) into opening intervals
+# over a horizon of a few weeks, and the intervals are indexed by hour, so a query only looks
+# at the rules open around that time. Rules can be added, changed or removed incrementally:
+# a rule is expanded when the first office uses it, and dropped with the last one.
+import argparse
+import datetime
+import sys
+import time
+import rule_files
+from opening_hours_rules import day_hours
+from opening_hours_store import SavedOpeningHours
+
+bucket_minutes = 60
+
+class OpeningHoursIndex:
+    def __init__(self, start, days=28):
+        self.start = datetime.datetime.combine(start, datetime.time())
+        self.days = days
+        self.rule_of = {}      # ref -> rule
+        self.offices = {}      # rule -> set of refs using it (its reference count)
+        self.intervals = {}    # rule -> [(start, end)] in minutes since self.start, None if it can't be evaluated
+        self.buckets = [dict() for i in range(days * 24 * 60 // bucket_minutes)] # rule -> [(start, end)] for each hour
+
+    # Minutes since the start of the index. The end of the index is only valid
+    # as the (excluded) end of a period, not as a point in time.
+    def minutes(self, when, end=False):
+        minutes = int((when - self.start).total_seconds() // 60)
+        if minutes < 0 or minutes > self.days * 24 * 60 or (minutes == self.days * 24 * 60 and not end):
+            raise ValueError('{0} is outside of the index, from {1} for {2} days'.format(when, self.start, self.days))
+        return minutes
+
+    def expand(self, rule):
+        intervals = []
+        for i in range(self.days):
+            hours = day_hours(rule, (self.start + datetime.timedelta(days=i)).date())
+            if hours is None:
+                return None
+            for start, end in hours:
+                intervals.append((i * 24 * 60 + start, i * 24 * 60 + end))
+        return intervals
+
+    def add_rule(self, rule):
+        intervals = self.expand(rule)
+        self.intervals[rule] = intervals
+        for start, end in intervals or []:
+            for bucket in range(start // bucket_minutes, min((end - 1) // bucket_minutes + 1, len(self.buckets))):
+                self.buckets[bucket].setdefault(rule, []).append((start, end))
+
+    def remove_rule(self, rule):
+        for start, end in self.intervals.pop(rule) or []:
+            for bucket in range(start // bucket_minutes, min((end - 1) // bucket_minutes + 1, len(self.buckets))):
+                self.buckets[bucket].pop(rule, None)
+
+    # Add, or change the rule of, one office
+    def set(self, ref, rule):
+        old_rule = self.rule_of.get(ref)
+        if old_rule == rule:
+            return
+        if old_rule is not None:
+            self.remove(ref)
+        self.rule_of[ref] = rule
+        if rule not in self.offices:
+            self.offices[rule] = set()
+            self.add_rule(rule)
+        self.offices[rule].add(ref)
+
+    def remove(self, ref):
+        rule = self.rule_of.pop(ref)
+        self.offices[rule].discard(ref)
+        if len(self.offices[rule]) == 0:
+            del self.offices[rule]
+            self.remove_rule(rule)
+
+    # Make the index match the given ref -> rule items, only touching what changed
+    def update(self, items):
+        refs = set()
+        for ref, rule in items:
+            refs.add(ref)
+            self.set(ref, rule)
+        for ref in [ref for ref in self.rule_of if ref not in refs]:
+            self.remove(ref)
+
+    def refs_for(self, rules):
+        refs = set()
+        for rule in rules:
+            refs.update(self.offices[rule])
+        return refs
+
+    # The rules with an opening interval overlapping [first, last)
+    def rules_open_during(self, first, last):
+        rules = set()
+        first_bucket = first // bucket_minutes
+        last_bucket = (last - 1) // bucket_minutes
+        for bucket in range(first_bucket, min(last_bucket + 1, len(self.buckets))):
+            if bucket * bucket_minutes >= first and (bucket + 1) * bucket_minutes <= last:
+                rules.update(self.buckets[bucket].keys()) # every interval in there overlaps
+            else:
+                for rule, intervals in self.buckets[bucket].items():
+                    if rule not in rules and any(start < last and end > first for start, end in intervals):
+                        rules.add(rule)
+        return rules
+
+    # The offices open at the given datetime
+    def open_at(self, when):
+        minute = self.minutes(when)
+        return self.refs_for(self.rules_open_during(minute, minute + 1))
+
+    # The offices not open at all between the given datetimes.
+    # Offices whose rule couldn't be evaluated are never part of the result.
+    def closed_during(self, first, last):
+        if first >= last:
+            raise ValueError('empty period, from {0} to {1}'.format(first, last))
+        open_rules = self.rules_open_during(self.minutes(first), self.minutes(last, end=True))
+        return self.refs_for(rule for rule in self.offices if rule not in open_rules and self.intervals[rule] is not None)
+
+    def unevaluated(self):
+        return self.refs_for(rule for rule in self.offices if self.intervals[rule] is None)
+
+def parse_time(text):
+    return datetime.datetime.fromisoformat(text)
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the post offices open at a given time, or closed during a given period')
+    parser.add_argument('--file', default='saved_opening_hours',
+                        help='rules to use: saved_opening_hours (default, with its journal) or data/new_opening_hours')
+    parser.add_argument('--start', help='first day of the index, YYYY-MM-DD (default: today)')
+    parser.add_argument('--days', type=int, default=28, help='number of days in the index (default: 28)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    open_parser = subparsers.add_parser('open-at', help='post offices open at the given time')
+    open_parser.add_argument('time', help='YYYY-MM-DD HH:MM')
+    closed_parser = subparsers.add_parser('closed-during', help='post offices closed for the whole period')
+    closed_parser.add_argument('first', help='YYYY-MM-DD[ HH:MM]')
+    closed_parser.add_argument('last', help='YYYY-MM-DD[ HH:MM], excluded')
+    args = parser.parse_args()
+
+    start = datetime.date.fromisoformat(args.start) if args.start else datetime.date.today()
+    if args.file.endswith('saved_opening_hours'):
+        store = SavedOpeningHours(args.file)
+        items = [(ref, entry[0], entry[1]) for ref, entry in store.items()]
+    else:
+        items = list(rule_files.load(args.file).items())
+    names = {ref: name for ref, name, hours in items}
+
+    build_start = time.perf_counter()
+    index = OpeningHoursIndex(start, args.days)
+    index.update((ref, hours) for ref, name, hours in items)
+    query_start = time.perf_counter()
+    try:
+        if args.command == 'open-at':
+            refs = index.open_at(parse_time(args.time))
+        else:
+            refs = index.closed_during(parse_time(args.first), parse_time(args.last))
+    except ValueError as e:
+        sys.stderr.write("ERROR: {0}\n".format(e))
+        sys.exit(1)
+    query_end = time.perf_counter()
+
+    for ref in sorted(refs):
+        print(ref + "|" + names[ref])
+    sys.stderr.write("{0} post offices. {1} distinct rules indexed in {2:.2f}s, query took {3:.1f}ms\n".format(
+                     len(refs), len(index.offices), query_start - build_start, (query_end - query_start) * 1000))
+    unevaluated = index.unevaluated()
+    if len(unevaluated) > 0:
+        sys.stderr.write("WARNING: {0} post offices have rules that couldn't be evaluated\n".format(len(unevaluated)))
+
+_index = OpeningHoursIndex(datetime.date(2026, 10, 12), 14) # Monday
+_index.update([('1', 'Mo-Fr 09:00-12:00,14:00-17:00; Sa 09:00-12:00; PH off'), ('2', 'Mo-Fr 09:00-12:00; PH off'),
+               ('3', 'Mo-Fr 09:00-12:00; PH off'), ('4', 'ERROR')])
+assert _index.open_at(datetime.datetime(2026, 10, 17, 10, 30)) == {'1'}
+assert _index.open_at(datetime.datetime(2026, 10, 13, 9, 0)) == {'1', '2', '3'}
+assert _index.open_at(datetime.datetime(2026, 10, 13, 12, 0)) == set()
+assert _index.closed_during(datetime.datetime(2026, 10, 17), datetime.datetime(2026, 10, 19)) == {'2', '3'}
+_index.update([('1', 'Mo-Fr 09:00-12:00,14:00-17:00; Sa 09:00-12:00; PH off'), ('2', 'Mo-Fr 09:00-12:00; PH off'),
+               ('3', 'Mo-Sa 10:00-12:00; PH off')])
+assert _index.open_at(datetime.datetime(2026, 10, 17, 10, 30)) == {'1', '3'}
+assert len(_index.offices) == 3 and _index.unevaluated() == set()
+assert _index.closed_during(datetime.datetime(2026, 10, 25), datetime.datetime(2026, 10, 26)) == {'1', '2', '3'}
+for _args in [(datetime.datetime(2026, 10, 26),), (datetime.datetime(2026, 10, 11, 23, 59),)]:
+    try:
+        _index.open_at(*_args)
+        assert False, 'outside of the index'
+    except ValueError:
+        pass
+try:
+    _index.closed_during(datetime.datetime(2026, 10, 19), datetime.datetime(2026, 10, 17))
+    assert False, 'empty period'
+except ValueError:
+    pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+# A small model of the opening_hours rules written by parse.pl, e.g.
+#   Mo-Fr 09:00-12:00,14:00-17:00; Sa 09:00-12:00; PH off; 2020 Dec 31,2021 Jan 05 09:00-12:00; 2021 Feb 08-12 off
+# Each rule string is parsed once (memoized) into the weekly rules, "PH off",
+# and the dated exceptions, so that two rules can be compared structurally.
+import datetime
+import functools
+import re
+from collections import namedtuple
+
+# base: the weekly rules (e.g. 'Mo-Fr 09:00-12:00', '2020 Fr 09:15-11:45', 'week 01-53/2 Sa 09:00-12:00'), in order
+# ph_off: whether the rule contains 'PH off'
+# exceptions: frozenset of (first day, last day, hours) for each date or date range, e.g. 2021 Feb 08-12 off
+Rule = namedtuple('Rule', ['base', 'ph_off', 'exceptions'])
+
+# added/removed: the dated exceptions only in the new/old rule
+RuleDiff = namedtuple('RuleDiff', ['base_changed', 'ph_off_added', 'ph_off_removed', 'added', 'removed'])
+
+month_numbers = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+                 'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+
+# The day must not be followed by a time, "2021 Jan 09:00-12:00" is the whole month of January
+date_re = re.compile(r'([0-9]{4}) ([A-Z][a-z]{2}) ([0-9]{2})(?:-([0-9]{2}))?(?![0-9:])')
+
+# One date, range of days, or a day in the same month or year as the previous date,
+# as in 2021 Feb 08-12 or 2023 Mar 30,Apr 01,14,20-22
+date_item_re = re.compile(r'(?:([0-9]{4}) )?(?:([A-Z][a-z]{2}) )?([0-9]{2})(?:-([0-9]{2}))?(?![0-9:])')
+
+# Returns the list of (first day, last day) at the start of the segment, and the remaining text (the hours).
+# The segment must start with a full date (see date_re).
+def parse_date_list(segment):
+    dates = []
+    year = month = None
+    pos = 0
+    while True:
+        m = date_item_re.match(segment, pos)
+        if m is None:
+            break
+        year = int(m.group(1)) if m.group(1) is not None else year
+        month = month_numbers[m.group(2)] if m.group(2) is not None else month
+        if year is None or month is None:
+            raise ValueError('Unsupported dates: ' + segment)
+        day = int(m.group(3))
+        last_day = int(m.group(4)) if m.group(4) is not None else day
+        dates.append((datetime.date(year, month, day), datetime.date(year, month, last_day)))
+        pos = m.end()
+        if segment.startswith(',', pos) and date_item_re.match(segment, pos + 1):
+            pos += 1
+        else:
+            break
+    return dates, segment[pos:].strip()
+
+# Returns None if the rule can't be parsed (ERROR rules, unknown dates...)
+@functools.lru_cache(maxsize=None)
+def parse_rule(opening_hours):
+    if 'ERROR' in opening_hours:
+        return None
+    base = []
+    ph_off = False
+    exceptions = set()
+    for segment in opening_hours.split(';'):
+        segment = segment.strip()
+        if segment == 'PH off':
+            ph_off = True
+        elif date_re.match(segment):
+            try:
+                dates, hours = parse_date_list(segment)
+            except (KeyError, ValueError):
+                return None
+            for first, last in dates:
+                exceptions.add((first, last, hours))
+        else:
+            base.append(segment)
+    return Rule(tuple(base), ph_off, frozenset(exceptions))
+
+def diff(old, new):
+    return RuleDiff(old.base != new.base,
+                    new.ph_off and not old.ph_off,
+                    old.ph_off and not new.ph_off,
+                    new.exceptions - old.exceptions,
+                    old.exceptions - new.exceptions)
+
+# True if the only difference is that some dated exceptions from the past were removed
+def old_special_days_removed(old_opening_hours, new_opening_hours, today=None):
+    # old: Mo-Fr 09:00-12:00,14:00-17:00; Sa 09:00-12:00; PH off; 2020 Dec 31,2021 Jan 05 09:00-12:00
+    # new: Mo-Fr 09:00-12:00,14:00-17:00; Sa 09:00-12:00; PH off; 2021 Jan 05 09:00-12:00
+    old = parse_rule(old_opening_hours)
+    new = parse_rule(new_opening_hours)
+    if old is None or new is None or not old.ph_off:
+        return False
+    d = diff(old, new)
+    if d.base_changed or d.ph_off_removed or len(d.added) > 0:
+        return False
+    if today is None:
+        today = datetime.date.today()
+    for first, last, hours in d.removed:
+        if last > today: # A change for a date in the future? Upload it.
+            return False
+    return True
+
+assert old_special_days_removed('Mo-Fr 09:00-12:00,14:00-17:00; Sa 09:00-12:00; PH off; 2020 Dec 31,2021 Jan 05 09:00-12:00',
+                                'Mo-Fr 09:00-12:00,14:00-17:00; Sa 09:00-12:00; PH off; 2021 Jan 05 09:00-12:00')
+assert old_special_days_removed('Mo-We,Fr 09:00-12:00,13:30-16:30; Th 10:00-12:00,13:30-16:30; Sa 09:00-12:00; PH off; 2021 Jan 13 13:30-16:30; 2021 Jan 04,2021 Jan 05,2021 Jan 06,2021 Jan 07,2021 Jan 08,2021 Jan 09,2021 Jan 11,2021 Jan 12 off',
+                                'Mo-We,Fr 09:00-12:00,13:30-16:30; Th 10:00-12:00,13:30-16:30; Sa 09:00-12:00; PH off; 2021 Jan 13 13:30-16:30; 2021 Jan 09,2021 Jan 11,2021 Jan 12 off')
+assert old_special_days_removed('Mo-Fr 08:50-11:50; PH off; 2021 Feb 08-12 off',
+                                'Mo-Fr 08:50-11:50; PH off')
+assert not old_special_days_removed('Mo-Fr 08:50-11:50; PH off; 2021 Feb 08-12 off',
+                                    'Mo-Fr 08:50-11:50; PH off', datetime.date(2021, 2, 10))
+assert not old_special_days_removed('Mo-Fr 08:50-11:50; PH off; 2021 Feb 08 off',
+                                    'Mo-Fr 08:50-11:50; PH off; 2021 Feb 08 09:00-11:00')
+assert not old_special_days_removed('Mo-Fr 08:50-11:50; PH off; 2021 Feb 08 off',
+                                    'Mo-Fr 08:50-12:00; PH off')
+assert parse_rule('Sa 08:00-12:00; 2021 Jan Sa 09:00-12:00; PH off').exceptions == frozenset()
+assert parse_rule('Mo-Sa 09:00-17:00; PH off; 2021 Jan 09:00-12:00') == Rule(('Mo-Sa 09:00-17:00', '2021 Jan 09:00-12:00'), True, frozenset())
+assert parse_rule('Tu,Th 14:00-17:30; PH off; 2023 Mar 30,Apr 01,14,20-22 off').exceptions == frozenset([
+    (datetime.date(2023, 3, 30), datetime.date(2023, 3, 30), 'off'), (datetime.date(2023, 4, 1), datetime.date(2023, 4, 1), 'off'),
+    (datetime.date(2023, 4, 14), datetime.date(2023, 4, 14), 'off'), (datetime.date(2023, 4, 20), datetime.date(2023, 4, 22), 'off')])
+
+# If the new rule is the old one with PH off added, and maybe some new dated exceptions,
+# returns these new exceptions (possibly none). Otherwise returns None.
+def ph_off_added(old_opening_hours, new_opening_hours):
+    old = parse_rule(old_opening_hours)
+    new = parse_rule(new_opening_hours)
+    if old is None or new is None:
+        return None
+    d = diff(old, new)
+    if d.base_changed or not d.ph_off_added or len(d.removed) > 0:
+        return None
+    return d.added
+
+assert ph_off_added('Mo-Fr 09:00-12:00; Sa 09:00-11:00', 'Mo-Fr 09:00-12:00; Sa 09:00-11:00; PH off') == frozenset()
+assert ph_off_added('Mo-Fr 09:00-12:00', 'Mo-Fr 09:00-12:00; PH off; 2021 Jan 02 off') == frozenset([
+    (datetime.date(2021, 1, 2), datetime.date(2021, 1, 2), 'off')])
+assert ph_off_added('Mo-Fr 09:00-12:00; PH off', 'Mo-Fr 09:00-12:00; PH off') is None
+assert ph_off_added('Mo-Fr 09:00-12:00', 'Mo-Fr 09:00-12:30; PH off') is None
+assert ph_off_added('Mo-Fr 09:00-12:00; 2021 Jan 02 off', 'Mo-Fr 09:00-12:00; PH off') is None
+
+# Evaluation of the rules on actual days (see opening_hours_query.py).
+# As in the opening_hours specification, the last rule matching a day gives the hours of that day.
+
+def easter(year):
+    # Anonymous Gregorian algorithm
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+# Jours fériés, same as in parse.pl
+@functools.lru_cache(maxsize=None)
+def public_holidays(year):
+    e = easter(year)
+    fixed = [(1, 1), (5, 1), (5, 8), (7, 14), (8, 15), (11, 1), (11, 11), (12, 25)]
+    return frozenset([datetime.date(year, m, d) for m, d in fixed] +
+                     [e + datetime.timedelta(days=1), e + datetime.timedelta(days=39), e + datetime.timedelta(days=50)])
+
+weekday_numbers = {'Mo': 0, 'Tu': 1, 'We': 2, 'Th': 3, 'Fr': 4, 'Sa': 5, 'Su': 6}
+
+# year, month, weeks (first, last, step): restrict the rule, None if unrestricted
+# weekdays: set of (weekday, nth) where nth is None for every week, 1 for the first one in the month, -1 for the last one
+# ph: whether the rule applies to public holidays, dates: the (first day, last day) of a dated rule
+Selector = namedtuple('Selector', ['year', 'month', 'weeks', 'weekdays', 'ph', 'dates'])
+
+year_re = re.compile(r'([0-9]{4}) ')
+month_re = re.compile(r'([A-Z][a-z]{2}) ')
+weeks_re = re.compile(r'week ([0-9]{2})-([0-9]{2})/([0-9]+) ')
+weekday_re = re.compile(r'(Mo|Tu|We|Th|Fr|Sa|Su|PH)(?:-(Mo|Tu|We|Th|Fr|Sa|Su))?(?:\[(-?[0-9])\])?')
+hours_re = re.compile(r'([0-9]{2}):([0-9]{2})-([0-9]{2}):([0-9]{2})')
+
+# "09:00-12:00,14:00-17:00" -> ((540, 720), (840, 1020)), "off" -> ()
+def parse_hours(hours):
+    if hours in ('off', 'closed'):
+        return ()
+    ranges = []
+    for item in hours.split(','):
+        m = hours_re.fullmatch(item)
+        if m is None:
+            raise ValueError('Unsupported hours: ' + hours)
+        ranges.append((int(m.group(1)) * 60 + int(m.group(2)), int(m.group(3)) * 60 + int(m.group(4))))
+    return tuple(ranges)
+
+def parse_weekdays(text):
+    weekdays = set()
+    ph = False
+    for item in text.split(','):
+        m = weekday_re.fullmatch(item)
+        if m is None:
+            raise ValueError('Unsupported weekdays: ' + text)
+        if m.group(1) == 'PH':
+            ph = True
+            continue
+        nth = int(m.group(3)) if m.group(3) is not None else None
+        first = weekday_numbers[m.group(1)]
+        last = weekday_numbers[m.group(2)] if m.group(2) is not None else first
+        for weekday in range(first, last + 1):
+            weekdays.add((weekday, nth))
+    return frozenset(weekdays), ph
+
+# One "selector hours" segment of a rule -> (Selector, hours as returned by parse_hours)
+def parse_segment(segment):
+    if segment == 'closed':
+        return Selector(None, None, None, None, True, None), ()
+    if date_re.match(segment):
+        dates, hours = parse_date_list(segment)
+        return Selector(None, None, None, None, False, tuple(dates)), parse_hours(hours)
+    year = month = weeks = None
+    m = year_re.match(segment)
+    if m:
+        year = int(m.group(1))
+        segment = segment[m.end():]
+        m = month_re.match(segment)
+        if m and m.group(1) in month_numbers:
+            month = month_numbers[m.group(1)]
+            segment = segment[m.end():]
+    m = weeks_re.match(segment)
+    if m:
+        weeks = (int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        segment = segment[m.end():]
+    words = segment.split(' ')
+    if len(words) == 2:
+        weekdays, ph = parse_weekdays(words[0])
+    elif len(words) == 1:
+        weekdays, ph = None, True # e.g. "2021 Jan 09:00-12:00": every day
+    else:
+        raise ValueError('Unsupported rule: ' + segment)
+    return Selector(year, month, weeks, weekdays, ph, None), parse_hours(words[-1])
+
+def selector_matches(selector, day, holidays):
+    if selector.dates is not None:
+        return any(first <= day <= last for first, last in selector.dates)
+    if selector.year is not None and day.year != selector.year:
+        return False
+    if selector.month is not None and day.month != selector.month:
+        return False
+    if selector.weeks is not None:
+        first, last, step = selector.weeks
+        week = day.isocalendar()[1]
+        if week < first or week > last or (week - first) % step != 0:
+            return False
+    if selector.weekdays is None:
+        return True
+    if selector.ph and day in holidays:
+        return True
+    for weekday, nth in selector.weekdays:
+        if weekday != day.weekday():
+            continue
+        if nth is None or (nth > 0 and (day.day - 1) // 7 + 1 == nth):
+            return True
+        if nth == -1 and (day + datetime.timedelta(days=7)).month != day.month:
+            return True
+    return False
+
+# The list of (Selector, hours) of a rule, or None if it can't be evaluated
+@functools.lru_cache(maxsize=None)
+def parse_segments(opening_hours):
+    if 'ERROR' in opening_hours:
+        return None
+    try:
+        return tuple(parse_segment(segment.strip()) for segment in opening_hours.split(';'))
+    except (KeyError, ValueError):
+        return None
+
+# The opening hours of the given day, as ((start minute, end minute), ...), or None if the rule can't be evaluated
+def day_hours(opening_hours, day):
+    segments = parse_segments(opening_hours)
+    if segments is None:
+        return None
+    holidays = public_holidays(day.year)
+    result = ()
+    for selector, hours in segments:
+        if selector_matches(selector, day, holidays):
+            result = hours
+    return result
+
+assert easter(2024) == datetime.date(2024, 3, 31) and easter(2027) == datetime.date(2027, 3, 28)
+assert day_hours('Mo-Fr 09:00-12:00,14:00-17:00; Sa 09:00-12:00; PH off', datetime.date(2026, 10, 17)) == ((540, 720),)
+assert day_hours('Mo-Fr 09:00-12:00,14:00-17:00; Sa 09:00-12:00; PH off', datetime.date(2026, 5, 14)) == () # ascension
+assert day_hours('Mo-Sa,PH 08:00-21:00', datetime.date(2026, 5, 14)) == ((480, 1260),)
+assert day_hours('Sa 09:00-12:00; Sa[-1] off; PH off', datetime.date(2026, 10, 31)) == ()
+assert day_hours('week 01-53/2 Sa 09:00-12:00; PH off', datetime.date(2026, 10, 17)) == () # week 42
+assert day_hours('Mo-Fr 09:00-12:00; PH off; 2026 Oct 12-16 off', datetime.date(2026, 10, 14)) == ()
+assert day_hours('Mo-Fr 09:00-12:00; 2026 Oct Mo-Fr 10:00-12:00; PH off', datetime.date(2026, 10, 14)) == ((600, 720),)
+assert day_hours('closed', datetime.date(2026, 10, 14)) == ()
+assert day_hours('Tu,Th 14:00-17:30; PH off; 2023 Mar 30,Apr 01,14,18,20-22 off', datetime.date(2023, 4, 18)) == ()
+assert day_hours('Mo-Fr 09:00-17:00; 2021 Jan 09:00-12:00', datetime.date(2021, 1, 10)) == ((540, 720),) # a Sunday
+assert day_hours('Mo-Fr 09:00-17:00; 2021 Jan 09:00-12:00', datetime.date(2021, 2, 15)) == ((540, 1020),)
@@ -0,0 +1,90 @@
+# The local DB of the opening hours uploaded by our scripts.
+# saved_opening_hours is the sorted file tracked by git, one "ref|name|hours" line per post office.
+# Committing .hours files first appends them to a journal (saved_opening_hours.journal, not
+# tracked by git), compacting then merges the journal back into the sorted file, once per batch.
+import os
+import sys
+import rule_files
+
+class SavedOpeningHours:
+    def __init__(self, db='saved_opening_hours'):
+        self.db = db
+        self.journal = db + '.journal'
+        self.table = None   # the sorted file, see rule_files.py, loaded on demand
+        self.changes = None # ref -> (name, hours) from the journal
+
+    def load(self):
+        if self.table is None:
+            self.table = rule_files.load(self.db)
+            # Later lines win, i.e. the last committed hours
+            self.changes = {}
+            if os.path.isfile(self.journal):
+                with open(self.journal) as f:
+                    for line in f:
+                        self.add_line(line)
+        return self
+
+    def add_line(self, line):
+        data = [item.strip() for item in line.split('|', 2)]
+        if len(data) < 3:
+            print("ERROR: invalid line " + line)
+            return None
+        ref, name, hours = data
+        self.changes[ref] = (name, sys.intern(hours))
+        return ref, name, hours
+
+    def entry(self, ref):
+        self.load()
+        entry = self.changes.get(ref)
+        if entry is None and ref in self.table:
+            entry = (self.table.name(ref), self.table.hours(ref))
+        return entry
+
+    def get(self, ref):
+        entry = self.entry(ref)
+        return None if entry is None else entry[1]
+
+    def name(self, ref):
+        entry = self.entry(ref)
+        return None if entry is None else entry[0]
+
+    def __contains__(self, ref):
+        self.load()
+        return ref in self.changes or ref in self.table
+
+    # ref, (name, hours) for all offices, sorted by ref
+    def items(self):
+        self.load()
+        refs = set(self.table.refs)
+        refs.update(self.changes.keys())
+        for ref in sorted(refs):
+            yield ref, self.entry(ref)
+
+    # Append the content of the given .hours files to the journal, in one go
+    def commit(self, hours_files):
+        self.load()
+        lines = []
+        for hours_file in hours_files:
+            with open(hours_file) as f:
+                for line in f:
+                    entry = self.add_line(line)
+                    if entry is not None:
+                        lines.append("|".join(entry) + "\n")
+        with open(self.journal, 'a') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        return len(lines)
+
+    # Rewrite the sorted file with the journal merged in, and empty the journal.
+    # office_names (ref -> name) can be given to update the names.
+    def compact(self, office_names=None):
+        if office_names is None:
+            office_names = {}
+        with open(self.db + ".new", "w") as f:
+            for ref, (name, hours) in self.items():
+                f.write(ref + "|" + office_names.get(ref, name) + "|" + hours + "\n")
+        os.rename(self.db + ".new", self.db)
+        if os.path.exists(self.journal):
+            os.remove(self.journal)
+        self.table = None
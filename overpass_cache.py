@@ -0,0 +1,113 @@
+# Local cache of the OSM post offices, kept up to date with Overpass.
+# The first fetch downloads all post offices, the next ones only download the objects
+# changed since the previous fetch (plus the list of ids, to notice removed objects).
+import json
+import os
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+
+default_endpoint = 'https://overpass-api.de/api/interpreter'
+selector = 'nwr["ref:FR:LaPoste"]["amenity"="post_office"]'
+
+def full_query(timeout):
+    return '[out:xml][timeout:{0}];{1};out meta center qt;'.format(timeout, selector)
+
+# Objects changed since `since`, then the ids of all current objects
+def incremental_query(timeout, since):
+    return ('[out:xml][timeout:{0}];{1}->.all;nwr.all(newer:"{2}");out meta center qt;.all out ids qt;'
+            .format(timeout, selector, since))
+
+def run_query(endpoint, query, timeout):
+    data = urllib.parse.urlencode({'data': query}).encode('utf-8')
+    with urllib.request.urlopen(endpoint, data, timeout=timeout) as response:
+        return response.read()
+
+# An incomplete response: Overpass reports runtime errors (timeout, out of memory) as a
+# <remark> with HTTP 200, after whatever it had output so far
+class OverpassError(Exception):
+    pass
+
+type_order = {'node': 0, 'way': 1, 'relation': 2}
+
+def sort_key(key):
+    osm_type, id = key.split('/')
+    return (type_order.get(osm_type, 3), int(id))
+
+class OverpassCache:
+    def __init__(self, cache_file='data/osm_post_offices_cache.json', endpoint=default_endpoint, timeout=3000):
+        self.cache_file = cache_file
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.timestamp = None  # osm_base of the last fetch
+        self.root_attrib = {}
+        self.elements = {}     # "node/123" -> {'version': 3, 'xml': '<node ...>...</node>'}
+        if os.path.isfile(cache_file):
+            with open(cache_file) as f:
+                data = json.load(f)
+            self.timestamp = data['timestamp']
+            self.root_attrib = data['root']
+            self.elements = data['elements']
+
+    def save(self):
+        with open(self.cache_file + '.new', 'w') as f:
+            json.dump({'timestamp': self.timestamp, 'root': self.root_attrib, 'elements': self.elements}, f)
+        os.rename(self.cache_file + '.new', self.cache_file)
+
+    # Fetch everything if the cache is empty or `full` is set, otherwise only what changed.
+    # Returns (number of objects downloaded, number of objects removed)
+    def update(self, full=False):
+        incremental = not full and self.timestamp is not None
+        if incremental:
+            query = incremental_query(self.timeout, self.timestamp)
+        else:
+            query = full_query(self.timeout)
+        root = ET.fromstring(run_query(self.endpoint, query, self.timeout))
+
+        # Check the whole response before touching the cache: with a missing list of ids,
+        # every cached object would be removed
+        remark = root.find('remark')
+        if remark is not None:
+            raise OverpassError('Overpass error: ' + (remark.text or '').strip())
+        if incremental and not any(child.tag in type_order and child.get('version') is None for child in root):
+            raise OverpassError('Overpass response without the ids of the current objects')
+
+        downloaded = {}
+        current_keys = set()
+        for child in root:
+            if child.tag == 'meta':
+                self.timestamp = child.get('osm_base')
+            elif child.tag in type_order:
+                key = child.tag + '/' + child.get('id')
+                current_keys.add(key)
+                if child.get('version') is not None: # not just an id
+                    ET.indent(child, '  ', 1)
+                    child.tail = None
+                    downloaded[key] = {'version': int(child.get('version')), 'xml': ET.tostring(child, 'unicode')}
+        self.root_attrib = dict(root.attrib)
+
+        if incremental:
+            removed = [key for key in self.elements if key not in current_keys]
+            for key in removed:
+                del self.elements[key]
+            for key, element in downloaded.items():
+                if key not in self.elements or self.elements[key]['version'] <= element['version']:
+                    self.elements[key] = element
+        else:
+            removed = [key for key in self.elements if key not in downloaded]
+            self.elements = downloaded
+        return len(downloaded), len(removed)
+
+    # Write all cached objects as an indented OSM XML file
+    def write_xml(self, filename):
+        with open(filename + '.new', 'w') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            attrs = ''.join(' {0}={1}'.format(k, quoteattr(v)) for k, v in self.root_attrib.items())
+            f.write('<osm' + attrs + '>\n')
+            if self.timestamp is not None:
+                f.write('  <meta osm_base=' + quoteattr(self.timestamp) + '/>\n')
+            for key in sorted(self.elements.keys(), key=sort_key):
+                f.write('  ' + self.elements[key]['xml'] + '\n')
+            f.write('</osm>\n')
+        os.rename(filename + '.new', filename)
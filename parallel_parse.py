@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# Front stage for parse.pl: stream the datanova CSV (decoding it on the fly),
+# split it into shards by office, run parse.pl on the shards in parallel, and merge
+# the results back, so that the output is the same as a single parse.pl run.
+# The rules of the offices whose rows didn't change since the last run are taken
+# from a cache instead (--rebuild to parse everything again).
+import argparse
+import csv
+import datetime
+import functools
+import hashlib
+import os
+import pickle
+import re
+import subprocess
+import sys
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from opening_hours_rules import public_holidays
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Same as in parse.pl: turn DD/MM/YYYY into YYYY-MM-DD
+def normalize_date(date):
+    m = re.match(r'^([0-9]+)/([0-9]+)/([0-9]{4})$', date)
+    if m:
+        return '{0}-{1:02d}-{2:02d}'.format(m.group(3), int(m.group(2)), int(m.group(1)))
+    return date
+
+def shard_for(office_id, num_shards):
+    # Not hash(), which changes from one run to the next
+    return zlib.crc32(office_id.encode('utf-8')) % num_shards
+
+# Iterate over the CSV rows, yielding (header, office id, normalized date, row)
+def read_rows(csv_file, encoding):
+    # Like parse.pl, skip the days in the past unless KEEPOLD is set
+    skip_old = 'KEEPOLD' not in os.environ
+    today = datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+    with open(csv_file, encoding=encoding, newline='') as f:
+        reader = csv.reader(f, delimiter=';')
+        header = next(reader, None)
+        if header is None:
+            sys.exit("No header found in CSV file")
+        col_office_id = header.index('#Identifiant')
+        col_date = header.index('Date_calendrier')
+        for row in reader:
+            if len(row) == 0:
+                continue
+            date = normalize_date(row[col_date])
+            if skip_old and date < today:
+                continue
+            yield header, row[col_office_id], date, row
+
+# The cache is keyed on a fingerprint of the normalized rows of each office and the file start
+# date: parse.pl gives the same rule and warnings for the same input.
+# The datanova file is a window of a few months, moving forward every day, so that key only
+# matches when the same file is parsed again. What doesn't change from one import to the next,
+# for most offices, is the weekly pattern: each weekday always has the same hours, public
+# holidays aside. parse.pl then writes the same rule whatever the dates
+# (e.g. "Mo-Fr 09:00-12:00; Sa 09:00-11:00; PH off"), so such offices are keyed on that pattern
+# instead, whatever the start date. Offices with dated exceptions have no pattern.
+class WeeklyPattern:
+    def __init__(self, name):
+        self.name = name
+        self.weekdays = {} # weekday -> hours
+        self.holidays = set() # (weekday, hours) on public holidays
+
+    # False if the row doesn't fit in a weekly pattern
+    def add(self, name, weekday, holiday, hours):
+        if name != self.name:
+            return False
+        if holiday:
+            self.holidays.add((weekday, hours))
+            return True
+        return self.weekdays.setdefault(weekday, hours) == hours
+
+    def fingerprint(self):
+        return ('week', hashlib.sha1(repr((self.name, sorted(self.weekdays.items()), sorted(self.holidays))).encode('utf-8')).hexdigest())
+
+# The normalized rows of one office, i.e. the date and the columns used by parse.pl
+class OfficeRows:
+    def __init__(self):
+        self.sha1 = hashlib.sha1()
+
+    def add(self, date, name, hours):
+        self.sha1.update(repr((date, name, hours)).encode('utf-8'))
+
+    def fingerprint(self, file_start_date):
+        rows = self.sha1.copy()
+        rows.update(file_start_date.encode('utf-8'))
+        return ('rows', rows.hexdigest())
+
+_patterns = [WeeklyPattern('BUREAU'), WeeklyPattern('BUREAU')]
+for _i, _day in enumerate(['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su', 'Mo']):
+    assert _patterns[0].add('BUREAU', _i % 7 + 1, False, _day)
+    assert _patterns[1].add('BUREAU', (_i + 3) % 7 + 1, False, ['Th', 'Fr', 'Sa', 'Su', 'Mo', 'Tu', 'We', 'Th'][_i])
+assert _patterns[0].fingerprint() == _patterns[1].fingerprint()
+assert not _patterns[0].add('BUREAU', 1, False, 'off') and _patterns[0].add('BUREAU', 1, True, 'off')
+
+# YYYY-MM-DD -> (ISO weekday, whether it's a public holiday)
+@functools.lru_cache(maxsize=None)
+def day_info(date):
+    day = datetime.date.fromisoformat(date)
+    return day.isoweekday(), day in public_holidays(day.year)
+
+# Split the CSV into utf8 shards, all the rows of one office going to the same shard,
+# finding the weekly pattern of each office on the way.
+# Returns the shard file names (by shard number), office id -> fingerprint of its weekly pattern
+# (or of its rows and the start date, if it has no pattern), and the start date.
+def split_csv(csv_file, encoding, num_shards, tmpdir):
+    shard_files = {}
+    writers = {}
+    file_start_date = None
+    patterns = {}
+    office_rows = {}
+    col_name = None
+    for header, office_id, date, row in read_rows(csv_file, encoding):
+        if col_name is None:
+            # name and opening hours, the only other columns used by parse.pl
+            col_name = header.index('Libellé_du_site')
+            col_opening = header.index('Plage_horaire_1')
+        if file_start_date is None or date < file_start_date:
+            file_start_date = date
+        if office_id not in patterns:
+            patterns[office_id] = WeeklyPattern(row[col_name])
+            office_rows[office_id] = OfficeRows()
+        hours = tuple(row[col_opening:col_opening + 4])
+        office_rows[office_id].add(date, row[col_name], hours)
+        pattern = patterns[office_id]
+        if pattern is not None:
+            try:
+                weekday, holiday = day_info(date)
+            except ValueError:
+                weekday = None
+            if weekday is None or not pattern.add(row[col_name], weekday, holiday, hours):
+                patterns[office_id] = None
+        shard = shard_for(office_id, num_shards)
+        if shard not in writers:
+            shard_files[shard] = open(os.path.join(tmpdir, 'shard' + str(shard) + '.csv'), 'w', encoding='utf-8', newline='')
+            writers[shard] = csv.writer(shard_files[shard], delimiter=';', lineterminator='\n')
+            writers[shard].writerow(header)
+        writers[shard].writerow(row)
+    for f in shard_files.values():
+        f.close()
+    fingerprints = {office_id: pattern.fingerprint() if pattern is not None else office_rows[office_id].fingerprint(file_start_date)
+                    for office_id, pattern in patterns.items()}
+    return {shard: f.name for shard, f in shard_files.items()}, fingerprints, file_start_date
+
+# The shards parse.pl has to go through: those with offices not in the cache,
+# without the rows of the offices that are (office ids never need CSV quoting)
+def shards_to_parse(shard_files, num_shards, fingerprints, misses):
+    shard_misses = {}
+    for office_id in misses:
+        shard_misses.setdefault(shard_for(office_id, num_shards), set()).add(office_id)
+    shard_sizes = {}
+    for office_id in fingerprints:
+        shard = shard_for(office_id, num_shards)
+        shard_sizes[shard] = shard_sizes.get(shard, 0) + 1
+    result = []
+    for shard, offices in sorted(shard_misses.items()):
+        if len(offices) == shard_sizes[shard]:
+            result.append(shard_files[shard])
+            continue
+        with open(shard_files[shard], encoding='utf-8') as f, open(shard_files[shard] + '.todo', 'w', encoding='utf-8') as todo:
+            todo.write(next(f))
+            todo.writelines(line for line in f if line.split(';', 1)[0] in offices)
+        result.append(todo.name)
+    return result
+
+# The per-office cache: the rules and warnings of each office, from a previous run,
+# valid as long as its fingerprint (see split_csv) and parse.pl itself are unchanged.
+# When keyed on the weekly pattern, only the offices whose rule doesn't mention any date are kept.
+dated_rule_re = re.compile(rb'\b[0-9]{4}\b|\bweek\b|ERROR')
+def cacheable(fingerprint, rules, blocks):
+    if len(rules) == 0:
+        return False
+    if fingerprint[0] == 'rows':
+        return True
+    return len(blocks) == 0 and not any(dated_rule_re.search(line.rsplit(b'|', 1)[-1]) for line in rules)
+
+assert cacheable(('week', 'x'), [b'00045A|BUREAU 2000|Mo-Fr 09:00-12:00; Sa 09:00-11:00; PH off\n'], [])
+assert not cacheable(('week', 'x'), [b'00045A|BUREAU|Mo-Fr 09:00-12:00; PH off; 2020 Dec 24 off\n'], [])
+assert not cacheable(('week', 'x'), [b'00045A|BUREAU|week 01-53/2 Sa 09:00-12:00; PH off\n'], [])
+assert cacheable(('rows', 'x'), [b'00045A|BUREAU|Mo-Fr 09:00-12:00; PH off; 2020 Dec 24 off\n'], [])
+
+def parse_pl_hash():
+    with open(os.path.join(script_dir, 'parse.pl'), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def load_cache(cache_file, parser_hash):
+    if cache_file == '' or not os.path.isfile(cache_file):
+        return {}
+    # A truncated or corrupt cache (e.g. from an older version) only means parsing everything again
+    try:
+        with open(cache_file, 'rb') as f:
+            cache = pickle.load(f)
+        if cache.get('parse.pl') != parser_hash:
+            return {}
+        return cache['offices']
+    except (OSError, EOFError, pickle.UnpicklingError, KeyError, AttributeError):
+        return {}
+
+def save_cache(cache_file, parser_hash, offices):
+    with open(cache_file + ".new", "wb") as f:
+        pickle.dump({'parse.pl': parser_hash, 'offices': offices}, f)
+    os.replace(cache_file + ".new", cache_file)
+
+def run_parse(shard_file, file_start_date):
+    env = dict(os.environ)
+    env['START_DATE'] = file_start_date
+    env['KEEPOLD'] = '1' # old days were already skipped by split_csv
+    return subprocess.run([os.path.join(script_dir, 'parse.pl'), shard_file], env=env, capture_output=True)
+
+def office_id_of_rule(line):
+    return line.split(b'|', 1)[0]
+
+# Split the warnings of one shard into blocks, one per WARNING/ERROR line
+# (followed by its indented details), tagged with the office they are about.
+# Any other line is DEBUGREF output, not a warning: those are returned separately.
+warning_re = re.compile(rb'^(WARNING|ERROR): (?:rule too long \([0-9]+\) )?([^:|]+)[:|]')
+def warning_blocks(stderr):
+    blocks = []
+    debug_lines = []
+    in_block = False
+    for line in stderr.splitlines(keepends=True):
+        m = warning_re.match(line)
+        if m:
+            # parse.pl writes all WARNINGs first, then the "rule too long" ERRORs
+            blocks.append([(0 if m.group(1) == b'WARNING' else 1, m.group(2)), line])
+            in_block = True
+        elif in_block and line[:1] in (b' ', b'\t'):
+            blocks[-1][1] += line
+        else:
+            debug_lines.append(line)
+            in_block = False
+    return blocks, debug_lines
+
+_blocks, _debug = warning_blocks(b'WARNING: 1A:X: Mo has multiple outcomes: a b\n   a on 1\n   b on 2\n'
+                                 b'X: Tu date_sets:\n   c on 3\nsingle day exception: deleting openings\n'
+                                 b'ERROR: rule too long (300) 2A|Y|Mo 09:00-12:00\n')
+assert _blocks == [[(0, b'1A'), b'WARNING: 1A:X: Mo has multiple outcomes: a b\n   a on 1\n   b on 2\n'],
+                   [(1, b'2A'), b'ERROR: rule too long (300) 2A|Y|Mo 09:00-12:00\n']]
+assert _debug == [b'X: Tu date_sets:\n', b'   c on 3\n', b'single day exception: deleting openings\n']
+
+def main():
+    parser = argparse.ArgumentParser(description='Run parse.pl on the datanova CSV, in parallel')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='number of shards and parallel parse.pl processes')
+    parser.add_argument('--encoding', default='latin1', help='encoding of the CSV file (default: latin1)')
+    parser.add_argument('--cache', default='data/parse_cache', help="per-office cache of the rules, '' to disable (default: data/parse_cache)")
+    parser.add_argument('--rebuild', action='store_true', help='ignore the cache and parse all offices again')
+    parser.add_argument('csv_file')
+    parser.add_argument('output', help='where to write the rules, e.g. data/new_opening_hours')
+    parser.add_argument('warnings', help='where to write the warnings, e.g. data/warnings')
+    args = parser.parse_args()
+
+    num_shards = max(1, args.jobs)
+    parser_hash = parse_pl_hash()
+    cache = {} if args.rebuild else load_cache(args.cache, parser_hash)
+    with tempfile.TemporaryDirectory(prefix='parse_shards_', dir=os.path.dirname(os.path.abspath(args.output))) as tmpdir:
+        shard_files, fingerprints, file_start_date = split_csv(args.csv_file, args.encoding, num_shards, tmpdir)
+        if file_start_date is None:
+            with open(args.warnings, 'w') as f:
+                f.write("No data found in " + args.csv_file + "\n")
+            sys.exit(1)
+
+        # office id -> (fingerprint, rule lines, warning blocks)
+        offices = {}
+        for office_id, fingerprint in fingerprints.items():
+            if office_id in cache and cache[office_id][0] == fingerprint:
+                offices[office_id] = cache[office_id]
+        hits = len(offices)
+        misses = set(fingerprints.keys()) - set(offices.keys())
+
+        shards = shards_to_parse(shard_files, num_shards, fingerprints, misses)
+        with ThreadPoolExecutor(max_workers=num_shards) as executor:
+            results = list(executor.map(lambda shard: run_parse(shard, file_start_date), shards))
+
+    failed = [result for result in results if result.returncode != 0]
+    if len(failed) > 0:
+        with open(args.warnings, 'wb') as f:
+            for result in failed:
+                f.write(result.stderr)
+                f.write(result.stdout)
+        sys.exit(1)
+
+    for office_id in misses:
+        offices[office_id] = (fingerprints[office_id], [], [])
+    other_blocks = [] # not about a specific office, not cached
+    for result in results:
+        for line in result.stdout.splitlines(keepends=True):
+            office_id = office_id_of_rule(line).decode('utf-8')
+            if office_id in offices:
+                offices[office_id][1].append(line)
+            else:
+                sys.stderr.buffer.write(line) # DEBUGREF output
+        blocks, debug_lines = warning_blocks(result.stderr)
+        sys.stderr.buffer.writelines(debug_lines)
+        for block in blocks:
+            office_id = block[0][1].decode('utf-8')
+            if office_id in offices:
+                offices[office_id][2].append(block)
+            else:
+                other_blocks.append(block)
+
+    rules = []
+    blocks = other_blocks
+    for office_id, (fingerprint, office_rules, office_blocks) in offices.items():
+        rules += office_rules
+        blocks += office_blocks
+    rules.sort(key=office_id_of_rule)
+    blocks.sort(key=lambda block: block[0])
+    with open(args.output, 'wb') as f:
+        f.writelines(rules)
+    with open(args.warnings, 'wb') as f:
+        f.writelines(block[1] for block in blocks)
+
+    if args.cache != '':
+        save_cache(args.cache, parser_hash, {office_id: entry for office_id, entry in offices.items() if cacheable(*entry)})
+    print("parse cache: {0} offices reused, {1} parsed again".format(hits, len(misses)))
+
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,9 @@ use POSIX qw(strftime);
 my $debug_me = defined $ENV{'DEBUGREF'} ? $ENV{'DEBUGREF'} : 'NONE';
 my $skip_old = not defined $ENV{'KEEPOLD'};
 my $file_start_date; # get it from the input file so that time passing doesn't break unittests
-my $file_dt; # same, parsed
+# When parsing one shard of the file (see parallel_parse.py), the start date of the whole file is passed to us
+my $fixed_start_date = defined $ENV{'START_DATE'};
+$file_start_date = $ENV{'START_DATE'} if $fixed_start_date;
 
 sub panic($) {
     print "@_\n";
@@ -82,78 +84,101 @@ sub abbrevs_with_repeated_rule($$) {
     return $ret;
 }
 
-sub fast_parse_datetime($) {
+# Calendar table: one entry per date ("YYYY-MM-DD"), built for a whole year the first time
+# a date of that year is looked up, so that each row of the CSV only costs a hash lookup.
+use constant {
+    CAL_DAY_OF_WEEK => 0,      # 1-7 (Monday is 1), 8 for public holidays
+    CAL_ISO_YEAR => 1,         # year of the ISO week
+    CAL_ISO_WEEK => 2,         # ISO week number
+    CAL_WEEKDAY_OF_MONTH => 3, # 1 for the first "weekday" of the month (e.g. first saturday)
+    CAL_LAST_OF_MONTH => 4,    # 1 for the last "weekday" of the month
+    CAL_MONTH => 5,            # 1-12
+};
+my %calendar = ();
+my %calendar_years = ();
+
+# Easter sunday, using the anonymous Gregorian algorithm. Returns (month, day)
+sub easter_sunday($) {
+    my ($year) = @_;
+    my $a = $year % 19;
+    my $b = int($year / 100);
+    my $c = $year % 100;
+    my $d = int($b / 4);
+    my $e = $b % 4;
+    my $f = int(($b + 8) / 25);
+    my $g = int(($b - $f + 1) / 3);
+    my $h = (19 * $a + $b - $d - $g + 15) % 30;
+    my $i = int($c / 4);
+    my $k = $c % 4;
+    my $l = (32 + 2 * $e + 2 * $i - $h - $k) % 7;
+    my $m = int(($a + 11 * $h + 22 * $l) / 451);
+    my $month = int(($h + $l - 7 * $m + 114) / 31);
+    my $day = ($h + $l - 7 * $m + 114) % 31 + 1;
+    return ($month, $day);
+}
+
+# Jours fériés
+sub public_holidays($) {
+    my ($year) = @_;
+    my %holidays = map { ("$year-$_" => 1) } ('01-01', '05-01', '05-08', '07-14', '08-15', '11-01', '11-11', '12-25');
+    my ($month, $day) = easter_sunday($year);
+    my $easter = DateTime->new(year => $year, month => $month, day => $day);
+    $holidays{$easter->clone()->add(days => 1)->ymd} = 1;  # lundi de pâques (easter monday)
+    $holidays{$easter->clone()->add(days => 39)->ymd} = 1; # ascension
+    $holidays{$easter->clone()->add(days => 50)->ymd} = 1; # lundi de pentecôte (whit monday)
+    return %holidays;
+}
+
+sub build_calendar_year($) {
+    my ($year) = @_;
+    my %holidays = public_holidays($year);
+    my $dt = DateTime->new(year => $year, month => 1, day => 1);
+    while ($dt->year == $year) {
+        my $date = $dt->ymd;
+        my $days_in_month = $dt->month_length;
+        my ($iso_year, $iso_week) = $dt->week;
+        my @entry;
+        $entry[CAL_DAY_OF_WEEK] = $holidays{$date} ? 8 : $dt->day_of_week;
+        $entry[CAL_ISO_YEAR] = $iso_year;
+        $entry[CAL_ISO_WEEK] = $iso_week;
+        $entry[CAL_WEEKDAY_OF_MONTH] = int(($dt->day - 1) / 7) + 1;
+        $entry[CAL_LAST_OF_MONTH] = ($dt->day + 7 > $days_in_month) ? 1 : 0;
+        $entry[CAL_MONTH] = $dt->month;
+        $calendar{$date} = \@entry;
+        $dt->add(days => 1);
+    }
+    $calendar_years{$year} = 1;
+}
+
+sub calendar_entry($) {
     my ($date) = @_;
-    # New format, it's actually day/month/year now
-    if ($date =~ /^([0-9]+)\/([0-9]+)\/([0-9]{4})$/) {
-        return DateTime->new(
-                day        => $1,
-                month      => $2,
-                year       => $3);
-    }
-    # Since we always have year-month-day, we can be much faster than the full parser
-    # parse_datetime: 83s. custom regexp: 66s.
-    # return DateTime::Format::ISO8601->parse_datetime($date);
-    if ($date =~ /^([0-9]{4})-([0-9]+)-([0-9]+)$/) {
-        return DateTime->new(
-                year       => $1,
-                month      => $2,
-                day        => $3);
-    }
-    die "Failed to parse date $date as day/month/year or year-month-day\n";
-    return undef;
+    my $entry = $calendar{$date};
+    return $entry if defined $entry;
+    my $year = get_year($date);
+    die "Invalid date $date\n" if !defined $year or defined $calendar_years{$year};
+    build_calendar_year($year);
+    $entry = $calendar{$date};
+    die "Invalid date $date\n" unless defined $entry;
+    return $entry;
 }
-# unittest
-die "Failed to parse ".fast_parse_datetime("2/4/2023")."\n" unless fast_parse_datetime("2/4/2023")->day == 2;
-
-my %cache = ();
 
 sub get_day_of_week($) {
-    my ($date) = @_;
-    my $entry = $cache{$date};
-    return $entry if defined $entry;
+    return calendar_entry(shift)->[CAL_DAY_OF_WEEK];
+}
 
-    my $dt = fast_parse_datetime($date);
-    my $day_of_week = $dt->day_of_week; # 1-7 (Monday is 1)
-    # Jours fériés
-    # We could use https://metacpan.org/pod/DateTime::Event::Easter but opensuse doesn't package it...
-    # NOTE: keep the old dates, they are used by the regression tests
-    if ($date =~ /-01-01$/ ||
-        $date eq '2021-04-05' || # paques (easter)
-        $date eq '2022-04-18' || # paques (easter), see https://en.wikipedia.org/wiki/Easter_Monday
-        $date eq '2023-04-10' || # paques (easter), see https://en.wikipedia.org/wiki/Easter_Monday
-        $date eq '2024-04-01' || # paques (easter), see https://en.wikipedia.org/wiki/Easter_Monday
-        $date eq '2025-04-21' || # paques (easter), see https://en.wikipedia.org/wiki/Easter_Monday
-        $date eq '2026-04-06' || # paques (easter), see https://en.wikipedia.org/wiki/Easter_Monday
-        $date eq '2027-03-29' || # paques (easter), see https://en.wikipedia.org/wiki/Easter_Monday
-        $date =~ /-05-01$/ ||
-        $date =~ /-05-08$/ ||
-        $date eq '2021-05-13' || # ascension
-        $date eq '2021-05-24' || # pentecote
-        $date eq '2022-05-26' || # ascension, cf https://fr.wikipedia.org/wiki/Ascension_(f%C3%AAte)
-        $date eq '2022-06-06' || # pentecote, add one to the date on https://fr.wikipedia.org/wiki/Pentec%C3%B4te
-        $date eq '2023-05-18' || # ascension, cf https://fr.wikipedia.org/wiki/Ascension_(f%C3%AAte)
-        $date eq '2023-05-29' || # pentecote, add one to the date on https://fr.wikipedia.org/wiki/Pentec%C3%B4te
-        $date eq '2024-05-09' || # ascension, cf https://fr.wikipedia.org/wiki/Ascension_(f%C3%AAte)
-        $date eq '2024-05-20' || # pentecote, add one to the date on https://fr.wikipedia.org/wiki/Pentec%C3%B4te
-        $date eq '2025-05-29' || # ascension, cf https://fr.wikipedia.org/wiki/Ascension_(f%C3%AAte)
-        $date eq '2025-06-09' || # pentecote, add one to the date on https://fr.wikipedia.org/wiki/Pentec%C3%B4te
-        $date eq '2026-05-14' || # ascension, cf https://fr.wikipedia.org/wiki/Ascension_(f%C3%AAte)
-        $date eq '2026-05-25' || # pentecote, add one to the date on https://fr.wikipedia.org/wiki/Pentec%C3%B4te
-        $date =~ /-07-14$/ ||
-        $date =~ /-08-15$/ ||
-        $date =~ /-11-01$/ ||
-        $date =~ /-11-11$/ ||
-        $date =~ /-12-25$/) {
-        $day_of_week = 8;
-    }
-    die "new year, please update the list of public holidays" if get_year($date) >= 2027;
-
-    $cache{$date} = $day_of_week;
-
-    return $day_of_week;
+# Returns (ISO year, ISO week number)
+sub get_week_number($) {
+    my $entry = calendar_entry(shift);
+    return ($entry->[CAL_ISO_YEAR], $entry->[CAL_ISO_WEEK]);
 }
 
+# unittests
+die "easter" unless join('-', easter_sunday(2024)) eq '3-31' and join('-', easter_sunday(2027)) eq '3-28';
+die "public holidays" unless get_day_of_week('2021-05-24') == 8 and get_day_of_week('2026-05-14') == 8 and get_day_of_week('2031-04-14') == 8;
+die "day of week" unless get_day_of_week('2021-05-25') == 2 and get_day_of_week('2030-12-31') == 2;
+die "week number" unless join('-', get_week_number('2021-01-03')) eq '2020-53';
+die "weekday of month" unless calendar_entry('2021-01-30')->[CAL_WEEKDAY_OF_MONTH] == 5 and calendar_entry('2021-01-25')->[CAL_LAST_OF_MONTH] == 1 and calendar_entry('2021-01-24')->[CAL_LAST_OF_MONTH] == 0;
+
 sub get_year($) {
     return (shift =~ /^([0-9]{4})/) ? $1 : undef;
 }
@@ -191,12 +216,6 @@ sub next_month($) {
     return $month % 12 + 1;
 }
 
-sub get_week_number($) {
-    my ($date) = @_;
-    my $dt = fast_parse_datetime($date);
-    return $dt->week;
-}
-
 # see unittest just below
 sub generate_date_list($) {
     my ($ref_dates) = @_;
@@ -407,10 +426,9 @@ sub month_for_all($) {
     my @dates = @$ref_dates;
     return undef if scalar @dates < 3; # Not enough
     #print "Dates:\n"; show_array(@dates);
-    my $month = get_month($dates[0]);
+    my $month = calendar_entry($dates[0])->[CAL_MONTH];
     foreach my $date (@dates) {
-        my $m = get_month($date);
-        return undef if ($month ne $m);
+        return undef if (calendar_entry($date)->[CAL_MONTH] != $month);
     }
     #print "all in month=$month\n";
     return $month;
@@ -445,7 +463,7 @@ sub try_month_exception($) {
     # Check that the other date set has no date in that month
     my $other_date_set = 1 - $date_set_number; # 0->1, 1->0
     foreach my $date (@{$date_sets[$other_date_set]}) {
-        return 0 if get_month($date) eq $exception_month;
+        return 0 if calendar_entry($date)->[CAL_MONTH] == $exception_month;
     }
     $rules->selectors(\@selectors); # assign
     return 1;
@@ -505,21 +523,22 @@ sub same_weekday_of_month_for_all($$$) {
     my @dates = @$ref_dates;
     return 0 if scalar @dates < 3; # Not enough
     my $current_month;
+    my $file_entry = calendar_entry($file_start_date);
     if ($which == -1) {
-        $current_month = previous_month($file_dt->month);
+        $current_month = previous_month($file_entry->[CAL_MONTH]);
     } else {
         # Do we expect to see the Nth "weekday" for this month, or is it in the past already?
-        $current_month = $file_dt->weekday_of_month <= $which ? previous_month($file_dt->month) : $file_dt->month;
-        say " $which: current_month: $current_month because file is from $file_dt" if ($context->office_id eq $debug_me);
+        $current_month = $file_entry->[CAL_WEEKDAY_OF_MONTH] <= $which ? previous_month($file_entry->[CAL_MONTH]) : $file_entry->[CAL_MONTH];
+        say " $which: current_month: $current_month because file is from $file_start_date" if ($context->office_id eq $debug_me);
     }
     for my $date (@dates) {
-        my $dt = fast_parse_datetime($date);
+        my $entry = calendar_entry($date);
         # last week of the month?
-        say "  $which: $date has weekday_of_month: " . $dt->weekday_of_month if ($context->office_id eq $debug_me);
-        if (($which == -1 && $dt->month != $dt->clone()->add(days => 7)->month)
-          || ($which > 0 && $dt->weekday_of_month == $which)) {
-            if (next_month($current_month) == $dt->month) {
-                $current_month = $dt->month;
+        say "  $which: $date has weekday_of_month: " . $entry->[CAL_WEEKDAY_OF_MONTH] if ($context->office_id eq $debug_me);
+        if (($which == -1 && $entry->[CAL_LAST_OF_MONTH])
+          || ($which > 0 && $entry->[CAL_WEEKDAY_OF_MONTH] == $which)) {
+            if (next_month($current_month) == $entry->[CAL_MONTH]) {
+                $current_month = $entry->[CAL_MONTH];
             } else {
                 return 0;
             }
@@ -760,13 +779,12 @@ sub main() {
         my $date = $row->[$col_date];
         die unless defined $date;
         # Turn DD/MM/YYYY to YYYY-MM-DD as it was before
-        if ($date =~ /\//) {
-            my $date_dt = fast_parse_datetime($date);
-            $date = $date_dt->year . "-" . sprintf("%02d", $date_dt->month) . "-" . sprintf("%02d", $date_dt->day);
+        if ($date =~ m{^([0-9]+)/([0-9]+)/([0-9]{4})$}) {
+            $date = sprintf("%04d-%02d-%02d", $3, $2, $1);
         }
 
         next if ($skip_old and $date lt $today);
-        $file_start_date = $date if (!defined $file_start_date or $date lt $file_start_date);
+        $file_start_date = $date if (!$fixed_start_date and (!defined $file_start_date or $date lt $file_start_date));
         my $opening = $row->[$col_opening];
         if ($row->[$col_opening + 1] ne '') {
             $opening .= "," . $row->[$col_opening + 1];
@@ -780,7 +798,6 @@ sub main() {
         push @{$office_data{$office_id}{$day_of_week}{$opening}}, $date;
     }
     die unless defined($file_start_date);
-    $file_dt = fast_parse_datetime($file_start_date);
     #print STDERR "Parsed $line_nr lines\n";
 
     # Aggregate the different opening hours for Mondays in different rules
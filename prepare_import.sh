@@ -16,17 +16,11 @@ if [ "$1" = "-updateosm" ]; then
 fi
 
 infile=data/laposte_ouvertur.csv
-if [ ! -s "$infile" -o -n "`find $infile -mtime +4  2>/dev/null`" ]; then
-    mkdir -p data
-    echo "Need to refetch the datanova data... OK?"
-    read confirmation
-    if [ -f $infile ]; then
-        mv -f $infile $infile.bak
-    fi
-    # 137MB download
-    #wget 'https://datanova.laposte.fr/explore/dataset/laposte_ouvertur/download/?format=csv&timezone=Europe/Berlin&lang=fr&use_labels_for_header=true&csv_separator=%3B' -O $infile
-    curl --request GET --url https://datanova.laposte.fr/data-fair/api/v1/datasets/laposte-ouvertur/raw -o $infile
-fi
+mkdir -p data
+# Only downloads the 137MB file if it changed on datanova, resumes an interrupted download,
+# and converts it to utf8 on the fly
+echo "Checking for new datanova data..."
+./fetch_datanova.py $infile || exit 1
 
 date=`date +'%Y-%m-%d'`
 
@@ -35,10 +29,11 @@ if [ -f data/new_opening_hours ]; then
 fi
 
 echo "Parsing datanova data to deduce opening_hours..."
-infile_utf8=data/laposte_ouvertur_utf8.csv
-iconv -f latin1 -t utf8 $infile > $infile_utf8
-
-if ! ./parse.pl $infile_utf8 > data/new_opening_hours 2> data/warnings; then
+parseoptions=
+if [ -n "$REBUILD" ]; then
+    parseoptions=--rebuild
+fi
+if ! parsestats=`./parallel_parse.py --encoding utf-8 $parseoptions $infile data/new_opening_hours data/warnings`; then
     tail -n 1 data/warnings
     exit 1
 fi
@@ -55,18 +50,16 @@ rm -f $statslink
 ln -s ../$stats $statslink
 echo "$statline"
 echo "$statline" > $stats
+echo "$parsestats"
+echo "$parsestats" >> $stats
 echo "(see ../warnings)"
 
 xmlfile=data/osm_post_offices.xml
 osmfile=data/osm_post_offices.osm
 
 if [ -n "$updateosm" -o ! -f $xmlfile -o -n "`find $xmlfile -mtime +1 2>/dev/null`" ]; then
-    echo "Refetching all post offices via overpass..."
-    if [ -f $xmlfile ]; then
-        mv -f $xmlfile $xmlfile.bak
-    fi
+    echo "Refetching post offices changed since the last fetch via overpass..."
     ./get_all_post_offices.py || exit 1
-    xmllint --format $xmlfile > _xml && mv _xml $xmlfile
 fi
 
 osm_post_offices_count=`grep k=\"ref:FR:LaPoste\" data/osm_post_offices.xml | wc -l`
@@ -84,30 +77,15 @@ rm -f $loglink
 ./process_post_offices.py > $log || exit 1
 ln -s ../$log $loglink
 
-echo "Reformatting..."
-xmllint --format $osmfile > _xml && mv _xml $osmfile
-
-diff $xmlfile $osmfile > $osmfile.diff
-
-adding=`grep 'no opening_hours in OSM' $log | wc -l`
-replacing=`grep ', replacing' $log | wc -l`
-touched=`grep 'modified meanwhile' $log | wc -l`
-agree=`grep agree $log | wc -l`
-disagree=`grep OSM\ says $log | wc -l`
-notin=`grep 'Not in datanova' $log | wc -l`
-onlycovid=`grep 'no opening_hours but covid hours' $log | wc -l`
-notready=`grep 'not ready' $log | wc -l`
-missingPH=`grep 'missing PH off' $log | wc -l`
-duperef=`grep 'duplicate ref' $log | wc -l`
-statline="$adding set because empty in OSM, $replacing to be updated, $missingPH only missing 'PH off', $disagree disagreements (skipped), $agree agreements, $touched skipped because modified by a human, $onlycovid blocked by covid hours (opening_hours empty), $notin not in datanova (wrong ref?), $duperef duplicate refs in OSM, $notready not ready (unresolved rules)"
-echo "$statline"
-echo "$statline" >> $stats
-
-actions=`grep -w modify $osmfile | wc -l`
-echo "$actions objects modified in total"
-echo "$actions objects modified in total" >> $stats
-
 ./filter_changes.py
+filter_status=$?
+
+# Decision counts and timings, from the events written by the two scripts above
+./summarize_events.py data/events.jsonl > data/stats_events || exit 1
+cat data/stats_events
+cat data/stats_events >> $stats
+rm -f data/stats_events
+[ $filter_status -eq 0 ] || exit 1
 
 echo 'Check data/process_post_offices.log and run ./upload_all.sh'
-echo 'Then remember to commit the new opening hours to git'
+echo 'Then remember to commit the new opening hours (saved_opening_hours) to git'
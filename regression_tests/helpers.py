@@ -0,0 +1,18 @@
+# Shared by the test_*.py files: a local HTTP server to run the stand-ins for the remote
+# services on, and the runner used when a test file is run directly (see run_all.sh)
+import http.server
+import threading
+
+# Serve the given request handler on a free local port, in the background.
+# Returns the server (to shut it down) and its base URL.
+def start_server(handler_class, threaded=False):
+    server_class = http.server.ThreadingHTTPServer if threaded else http.server.HTTPServer
+    server = server_class(('127.0.0.1', 0), handler_class)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{0}'.format(server.server_port)
+
+# Run all the test_* functions of a test module, given its globals()
+def run_tests(namespace):
+    for name, test in list(namespace.items()):
+        if name.startswith('test_') and callable(test):
+            test()
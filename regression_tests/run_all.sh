@@ -6,9 +6,34 @@ for name in *.csv; do
     base=${name%%.*}
     echo $base.csv
     export KEEPOLD=1
-    ../parse.pl $base.csv > $base.out || exit 1
+    ../parse.pl $base.csv > $base.out 2> $base.expected_warnings || exit 1
     # Update baseline:
     #cp $base.out $base.expected
     diff -u $base.expected $base.out || exit 2
     rm -f $base.out
+    # Same thing, split into shards parsed in parallel, then again from the per-office cache
+    for pass in parse cache; do
+        ../parallel_parse.py -j 3 --encoding utf-8 --cache $base.cache $base.csv $base.out $base.warnings > /dev/null || exit 1
+        diff -u $base.expected $base.out || exit 2
+        diff -u $base.expected_warnings $base.warnings || exit 2
+        rm -f $base.out $base.warnings
+    done
+    # The next download: the first day is gone, so the start date moved. With the cache of the
+    # full file, the output must still be the same as parse.pl's on the shorter file
+    PYTHONPATH=.. python3 -c "import sys; from parallel_parse import read_rows
+rows = list(read_rows(sys.argv[1], 'utf-8'))
+first = min(date for header, office_id, date, row in rows)
+print(';'.join(rows[0][0]))
+print(''.join(';'.join(row) + '\\n' for header, office_id, date, row in rows if date != first), end='')" $base.csv > $base.shifted.csv || exit 1
+    ../parse.pl $base.shifted.csv > $base.shifted.expected 2> $base.shifted.expected_warnings || exit 1
+    ../parallel_parse.py -j 3 --encoding utf-8 --cache $base.cache $base.shifted.csv $base.out $base.warnings > /dev/null || exit 1
+    diff -u $base.shifted.expected $base.out || exit 2
+    diff -u $base.shifted.expected_warnings $base.warnings || exit 2
+    rm -f $base.out $base.warnings $base.shifted.*
+    rm -f $base.cache $base.expected_warnings
+done
+
+for name in test_*.py; do
+    echo $name
+    python3 $name || exit 3
 done
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# Tests for fetch_datanova.py, against a local stand-in for the datanova server
+import http.server
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fetch_datanova import fetch
+from helpers import start_server, run_tests
+
+content = ('#Identifiant;Libellé_du_site;Date_calendrier\n' +
+           ''.join('{0:05d}A;BUREAU DE POSTE {0} ÉPINAL;17/10/2026\n'.format(i) for i in range(2000))).encode('latin1')
+
+class StandInDatanova(http.server.BaseHTTPRequestHandler):
+    etag = '"v1"'
+    cut_after = None # simulate a connection dropped after that many bytes
+    requests = []
+
+    def do_GET(self):
+        StandInDatanova.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        if self.headers.get('Range') and self.headers.get('If-Range') == self.etag:
+            start = int(self.headers['Range'][len('bytes='):].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, len(content) - 1, len(content)))
+        else:
+            self.send_response(200)
+        body = content[start:]
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if StandInDatanova.cut_after is not None:
+            self.wfile.write(body[:StandInDatanova.cut_after])
+            StandInDatanova.cut_after = None
+            self.close_connection = True
+        else:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# Sends the file in chunks, without any Content-Length, and drops the connection in the
+# middle of the second chunk
+class TruncatedChunkedDatanova(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('ETag', '"v3"')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.wfile.write(b'1388\r\n' + content[:5000] + b'\r\n')
+        self.wfile.write(b'1388\r\n' + content[5000:7000])
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+def test_download_then_not_modified():
+    server, url = start_server(StandInDatanova)
+    url += '/raw'
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output = os.path.join(tmpdir, 'laposte_ouvertur.csv')
+        assert fetch(url, output, 10)
+        with open(output, 'rb') as f:
+            assert f.read() == content.decode('latin1').encode('utf-8')
+        assert not fetch(url, output, 10)
+        assert StandInDatanova.requests[-1]['If-None-Match'] == '"v1"'
+    server.shutdown()
+
+def test_resume_after_failure():
+    server, url = start_server(StandInDatanova)
+    url += '/raw'
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output = os.path.join(tmpdir, 'laposte_ouvertur.csv')
+        # Cut in the middle of the file, right after an 'É'
+        cut = content.index('É'.encode('latin1'), len(content) // 2) + 1
+        StandInDatanova.cut_after = cut
+        try:
+            fetch(url, output, 10)
+            assert False, 'the download should have failed'
+        except IOError:
+            pass
+        assert not os.path.exists(output)
+        assert fetch(url, output, 10)
+        assert StandInDatanova.requests[-1]['Range'] == 'bytes={0}-'.format(cut)
+        with open(output, 'rb') as f:
+            assert f.read() == content.decode('latin1').encode('utf-8')
+        assert not os.path.exists(output + '.part')
+    server.shutdown()
+
+def test_changed_during_resume():
+    server, url = start_server(StandInDatanova)
+    url += '/raw'
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output = os.path.join(tmpdir, 'laposte_ouvertur.csv')
+        StandInDatanova.cut_after = 1000
+        try:
+            fetch(url, output, 10)
+        except IOError:
+            pass
+        # New version on the server: If-Range doesn't match, the whole file comes again
+        StandInDatanova.etag = '"v2"'
+        assert fetch(url, output, 10)
+        with open(output, 'rb') as f:
+            assert f.read() == content.decode('latin1').encode('utf-8')
+        StandInDatanova.etag = '"v1"'
+    server.shutdown()
+
+def test_truncated_chunked_download():
+    server, url = start_server(StandInDatanova)
+    truncating_server, truncating_url = start_server(TruncatedChunkedDatanova)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output = os.path.join(tmpdir, 'laposte_ouvertur.csv')
+        assert fetch(url + '/raw', output, 10)
+        try:
+            fetch(truncating_url + '/raw', output, 10)
+            assert False, 'the download should have failed'
+        except IOError:
+            pass
+        # The previous file is still there, and what was received is kept to resume from
+        with open(output, 'rb') as f:
+            assert f.read() == content.decode('latin1').encode('utf-8')
+        assert os.path.exists(output + '.part')
+    truncating_server.shutdown()
+    server.shutdown()
+
+if __name__ == '__main__':
+    run_tests(globals())
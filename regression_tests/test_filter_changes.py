@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# Tests for filter_changes.py: the .osc and .hours files written for the objects
+# of filter_changes/osm_post_offices.osm must match the *.expected files there. The .osc ones
+# were written by filter_changes.py itself: they pin its own format, so that any change to it
+# is deliberate, and say nothing about compatibility with osm2change.py (osm-bulk-upload).
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from helpers import run_tests
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+fixture_dir = os.path.join(tests_dir, 'filter_changes')
+
+def test_osc_files():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.mkdir(os.path.join(tmpdir, 'data'))
+        for name in ('osm_post_offices.osm', 'new_opening_hours'):
+            shutil.copy(os.path.join(fixture_dir, name), os.path.join(tmpdir, 'data', name))
+        subprocess.run([sys.executable, os.path.join(tests_dir, '..', 'filter_changes.py')], cwd=tmpdir,
+                       check=True, stdout=subprocess.DEVNULL)
+        expected = sorted(name[:-len('.expected')] for name in os.listdir(fixture_dir) if name.endswith('.expected'))
+        assert sorted(os.listdir(os.path.join(tmpdir, 'changes'))) == expected
+        for name in expected:
+            with open(os.path.join(fixture_dir, name + '.expected'), 'rb') as f:
+                expected_content = f.read()
+            with open(os.path.join(tmpdir, 'changes', name), 'rb') as f:
+                assert f.read() == expected_content, name
+
+def test_keeps_uncommitted_changes():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.mkdir(os.path.join(tmpdir, 'data'))
+        for name in ('osm_post_offices.osm', 'new_opening_hours'):
+            shutil.copy(os.path.join(fixture_dir, name), os.path.join(tmpdir, 'data', name))
+        os.mkdir(os.path.join(tmpdir, 'changes'))
+        with open(os.path.join(tmpdir, 'changes', 'upload_journal'), 'w') as f:
+            f.write('uploaded|changes/0.osc|100\nuploaded|changes/1.osc|101\ncommitted|changes/0.osc\n')
+        result = subprocess.run([sys.executable, os.path.join(tests_dir, '..', 'filter_changes.py')], cwd=tmpdir,
+                                stdout=subprocess.DEVNULL)
+        assert result.returncode != 0
+        assert os.listdir(os.path.join(tmpdir, 'changes')) == ['upload_journal']
+        # The failed run is the last one in the event log
+        summary = subprocess.run([sys.executable, os.path.join(tests_dir, '..', 'summarize_events.py'), 'data/events.jsonl'],
+                                 cwd=tmpdir, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        assert 'filter_changes: failed, 1 changesets uploaded but not committed\n' in summary
+        assert 'changeset(s)' not in summary
+
+if __name__ == '__main__':
+    run_tests(globals())
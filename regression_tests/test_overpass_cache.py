@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Tests for overpass_cache.py, against a local stand-in for the Overpass API
+import http.server
+import os
+import sys
+import tempfile
+import urllib.parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from overpass_cache import OverpassCache, OverpassError
+from helpers import start_server, run_tests
+
+full_response = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="Overpass API">
+<meta osm_base="2024-01-01T00:00:00Z"/>
+  <node id="1" lat="48.1" lon="2.1" version="1"><tag k="ref:FR:LaPoste" v="00001A"/></node>
+  <node id="2" lat="48.2" lon="2.2" version="4"><tag k="ref:FR:LaPoste" v="00002A"/></node>
+  <way id="3" version="2"><center lat="45.0" lon="3.0"/><tag k="ref:FR:LaPoste" v="00003A"/></way>
+</osm>
+'''
+
+# node 1 modified, node 2 deleted (not in the ids anymore), node 5 created
+incremental_response = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="Overpass API">
+<meta osm_base="2024-01-02T00:00:00Z"/>
+  <node id="1" lat="48.1" lon="2.1" version="2"><tag k="ref:FR:LaPoste" v="00001A"/><tag k="opening_hours" v="Mo 09:00-12:00"/></node>
+  <node id="5" lat="48.5" lon="2.5" version="1"><tag k="ref:FR:LaPoste" v="00005A"/></node>
+  <node id="1"/>
+  <node id="5"/>
+  <way id="3"/>
+</osm>
+'''
+
+# Runtime error after the changed objects, so without the ids
+remark_response = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="Overpass API">
+<meta osm_base="2024-01-02T00:00:00Z"/>
+  <node id="1" lat="48.1" lon="2.1" version="2"><tag k="ref:FR:LaPoste" v="00001A"/></node>
+<remark> runtime error: Query timed out in "query" at line 1 after 3000 seconds. </remark>
+</osm>
+'''
+
+# Truncated before the ids, without a remark
+no_ids_response = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="Overpass API">
+<meta osm_base="2024-01-02T00:00:00Z"/>
+</osm>
+'''
+
+class StandInOverpass(http.server.BaseHTTPRequestHandler):
+    queries = []
+    incremental_response = incremental_response
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        query = urllib.parse.parse_qs(body)['data'][0]
+        StandInOverpass.queries.append(query)
+        response = (StandInOverpass.incremental_response if 'newer:' in query else full_response).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/osm3s+xml')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+def test_full_then_incremental():
+    server, endpoint = start_server(StandInOverpass)
+    endpoint += '/api/interpreter'
+    StandInOverpass.queries = []
+    StandInOverpass.incremental_response = incremental_response
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_file = os.path.join(tmpdir, 'cache.json')
+        xml_file = os.path.join(tmpdir, 'osm_post_offices.xml')
+
+        cache = OverpassCache(cache_file, endpoint, 10)
+        assert cache.update() == (3, 0)
+        cache.save()
+        assert 'newer:' not in StandInOverpass.queries[-1]
+
+        # Reload from disk, as the next run would
+        cache = OverpassCache(cache_file, endpoint, 10)
+        assert cache.update() == (2, 1)
+        assert 'newer:"2024-01-01T00:00:00Z"' in StandInOverpass.queries[-1]
+        assert sorted(cache.elements.keys()) == ['node/1', 'node/5', 'way/3']
+        assert cache.elements['node/1']['version'] == 2
+        assert cache.timestamp == '2024-01-02T00:00:00Z'
+        cache.write_xml(xml_file)
+        with open(xml_file) as f:
+            xml = f.read()
+        assert xml.index('id="1"') < xml.index('id="5"') < xml.index('way id="3"')
+        assert '    <tag k="opening_hours" v="Mo 09:00-12:00" />' in xml
+
+        # --full drops the objects that are not in the full download
+        cache.update(True)
+        assert sorted(cache.elements.keys()) == ['node/1', 'node/2', 'way/3']
+    server.shutdown()
+
+def test_incomplete_responses():
+    server, endpoint = start_server(StandInOverpass)
+    endpoint += '/api/interpreter'
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_file = os.path.join(tmpdir, 'cache.json')
+        StandInOverpass.incremental_response = incremental_response
+        cache = OverpassCache(cache_file, endpoint, 10)
+        cache.update()
+        cache.save()
+        try:
+            for response, message in ((remark_response, 'Query timed out'), (no_ids_response, 'without the ids')):
+                StandInOverpass.incremental_response = response
+                cache = OverpassCache(cache_file, endpoint, 10)
+                try:
+                    cache.update()
+                    assert False, 'no OverpassError'
+                except OverpassError as e:
+                    assert message in str(e)
+                # Nothing changed
+                assert sorted(cache.elements.keys()) == ['node/1', 'node/2', 'way/3']
+                assert cache.elements['node/1']['version'] == 1
+                assert cache.timestamp == '2024-01-01T00:00:00Z'
+        finally:
+            StandInOverpass.incremental_response = incremental_response
+    server.shutdown()
+
+if __name__ == '__main__':
+    run_tests(globals())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# Tests for rule_files.py and its .cache sidecar file
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import rule_files
+from helpers import run_tests
+
+# Load the file, returning the table and whether it was parsed (rather than taken from the cache)
+def load(filename):
+    parse = rule_files.parse
+    parsed = []
+    def counting_parse(filename):
+        parsed.append(filename)
+        return parse(filename)
+    rule_files.parse = counting_parse
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            table = rule_files.load(filename)
+    finally:
+        rule_files.parse = parse
+    return table, len(parsed) > 0
+
+def write(filename, content, mtime):
+    with open(filename, 'w') as f:
+        f.write(content)
+    os.utime(filename, ns=(mtime, mtime))
+
+def test_sidecar_cache():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'saved_opening_hours')
+        write(filename, '00001A|BUREAU 1|Mo 09:00-12:00\n00002A|BUREAU 2|Mo 09:00-12:00\n', 1000000000 * 10**9)
+        table, parsed = load(filename)
+        assert parsed and os.path.isfile(filename + '.cache')
+        assert table.hours('00002A') == 'Mo 09:00-12:00' and len(table.rules) == 1
+
+        # Same mtime and size: taken from the cache
+        table, parsed = load(filename)
+        assert not parsed and table.name('00001A') == 'BUREAU 1'
+
+        # Only the mtime changed (e.g. git checkout): same sha1, still taken from the cache
+        os.utime(filename, ns=(1000000100 * 10**9, 1000000100 * 10**9))
+        table, parsed = load(filename)
+        assert not parsed and table.hours('00001A') == 'Mo 09:00-12:00'
+        # and the cache now has the new mtime
+        assert rule_files.read_cache(filename + '.cache')['stamp'][0] == 1000000100 * 10**9
+
+        # New content, same size: the sha1 differs, parsed again
+        write(filename, '00001A|BUREAU 1|Tu 09:00-12:00\n00002A|BUREAU 2|Mo 09:00-12:00\n', 1000000200 * 10**9)
+        table, parsed = load(filename)
+        assert parsed and table.hours('00001A') == 'Tu 09:00-12:00'
+        table, parsed = load(filename)
+        assert not parsed and table.hours('00001A') == 'Tu 09:00-12:00'
+
+        # New content and size, same mtime: parsed again
+        write(filename, '00001A|BUREAU 1|Tu 09:00-12:00\n', 1000000200 * 10**9)
+        table, parsed = load(filename)
+        assert parsed and len(table) == 1
+
+def test_invalid_lines():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'new_opening_hours')
+        write(filename, '00001A|BUREAU 1|Mo 09:00-12:00\nbroken line\n', 1000000000 * 10**9)
+        for i in range(2): # parsed, then from the cache
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                rule_files.load(filename)
+            assert output.getvalue() == 'ERROR: invalid line broken line\n\n'
+
+if __name__ == '__main__':
+    run_tests(globals())
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# Tests for upload_changes.py, against a local stand-in for the OSM API
+import http.server
+import os
+import sys
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from upload_changes import OsmApiSession, UploadJournal, bearer_authorization, basic_authorization, upload, commit
+from opening_hours_store import SavedOpeningHours
+from helpers import start_server, run_tests
+
+class StandInOsmApi(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive
+    lock = threading.Lock()
+    next_id = 100
+    changesets = {}   # id -> {'tags': {}, 'uploaded': [object ids], 'closed': bool}
+    connections = set()
+    fail_object = None # an upload containing this object id gets a conflict
+    close_idle = False # close the connection after each response, like a server with a short keep-alive timeout
+
+    def reply(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if StandInOsmApi.close_idle:
+            self.close_connection = True
+
+    def handle_request(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with StandInOsmApi.lock:
+            StandInOsmApi.connections.add(self.client_address)
+        # An OAuth 2 token, as on openstreetmap.org, or HTTP Basic auth, as on some dev servers
+        if self.headers.get('Authorization') not in (bearer_authorization('token'), basic_authorization('bot', 'secret')):
+            return self.reply(401, b"Couldn't authenticate you")
+        parts = self.path.split('/')
+        if self.command == 'PUT' and self.path == '/api/0.6/changeset/create':
+            changeset = ET.fromstring(body).find('changeset')
+            with StandInOsmApi.lock:
+                changeset_id = str(StandInOsmApi.next_id)
+                StandInOsmApi.next_id += 1
+                StandInOsmApi.changesets[changeset_id] = {
+                    'tags': {tag.get('k'): tag.get('v') for tag in changeset.findall('tag')},
+                    'uploaded': [], 'closed': False}
+            return self.reply(200, changeset_id.encode('ascii'))
+        changeset = StandInOsmApi.changesets.get(parts[4]) if len(parts) == 6 else None
+        if changeset is None or changeset['closed']:
+            return self.reply(409, b'The changeset is closed')
+        if self.command == 'POST' and parts[5] == 'upload':
+            objects = [child for action in ET.fromstring(body) for child in action]
+            if any(child.get('changeset') != parts[4] for child in objects):
+                return self.reply(409, b'Changeset mismatch')
+            if any(child.get('id') == StandInOsmApi.fail_object for child in objects):
+                return self.reply(409, b'Version mismatch')
+            changeset['uploads'] = changeset.get('uploads', 0) + 1
+            changeset['uploaded'] = [child.tag + '/' + child.get('id') for child in objects]
+            return self.reply(200, b'<diffResult/>')
+        if self.command == 'PUT' and parts[5] == 'close':
+            changeset['closed'] = True
+            return self.reply(200)
+        self.reply(404)
+
+    do_PUT = handle_request
+    do_POST = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+def start_api():
+    StandInOsmApi.changesets = {}
+    StandInOsmApi.connections = set()
+    return start_server(StandInOsmApi, threaded=True)
+
+def write_changes(count):
+    os.mkdir('changes')
+    os.mkdir('data')
+    osc_files = []
+    with open('data/new_opening_hours', 'w') as new_hours:
+        for i in range(count):
+            prefix = ['', 'ph_off_', 'update_'][i % 3]
+            ref = '{0:05d}A'.format(i)
+            with open('changes/{0}{1}.osc'.format(prefix, i), 'w') as f:
+                f.write('<osmChange version="0.6" generator="filter_changes.py"><modify>'
+                        '<node id="{0}" lat="48.0" lon="2.0" version="1"><tag k="ref:FR:LaPoste" v="{1}" />'
+                        '<tag k="opening_hours" v="Mo 09:00-12:00" /></node></modify></osmChange>'.format(i + 1, ref))
+            with open('changes/{0}{1}.hours'.format(prefix, i), 'w') as f:
+                f.write(ref + '|BUREAU ' + str(i) + '|Mo 09:00-12:00\n')
+            new_hours.write(ref + '|BUREAU ' + str(i) + '|Mo 09:00-12:00\n')
+            osc_files.append('changes/{0}{1}.osc'.format(prefix, i))
+    return osc_files
+
+def test_upload_resume_and_commit():
+    server, api = start_api()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        try:
+            osc_files = write_changes(12)
+            session = OsmApiSession(api, bearer_authorization('token'), connections=3, rate=1000)
+
+            # First run: one changeset is rejected
+            StandInOsmApi.fail_object = '5'
+            journal = UploadJournal('changes/upload_journal')
+            assert upload(session, osc_files, journal, 3, '1.2.0', '2026-10-17') == 1
+            assert len(journal.uploaded) == 11
+            assert all(changeset['closed'] for changeset in StandInOsmApi.changesets.values())
+            # All requests went through the same 3 keep-alive connections
+            assert len(StandInOsmApi.connections) <= 3
+
+            # Second run, from the journal: only the failed one is uploaded again
+            StandInOsmApi.fail_object = None
+            created = len(StandInOsmApi.changesets)
+            journal = UploadJournal('changes/upload_journal')
+            assert upload(session, osc_files, journal, 3, '1.2.0', '2026-10-17') == 0
+            assert len(StandInOsmApi.changesets) == created + 1
+            assert len(journal.uploaded) == 12
+
+            tags = StandInOsmApi.changesets[journal.uploaded['changes/update_2.osc']]['tags']
+            assert tags['comment'] == "Mise à jour des opening_hours précédemment importés"
+            assert tags['created_by'] == 'DataNovaImportScripts 1.2.0, via upload_changes.py'
+            assert tags['source'] == 'datanova.laposte.fr, 2026-10-17'
+            assert tags['url'] == 'https://wiki.openstreetmap.org/wiki/Import/FrenchPostOfficeOpeningHours'
+            assert tags['import'] == 'yes'
+            assert StandInOsmApi.changesets[journal.uploaded['changes/ph_off_4.osc']]['uploaded'] == ['node/5']
+            session.close()
+
+            # All .hours files are committed at once, and only once, and merged into the sorted file
+            assert commit(journal) == 12
+            assert commit(UploadJournal('changes/upload_journal')) == 0
+            with open('saved_opening_hours') as f:
+                assert len(f.readlines()) == 12
+            assert not os.path.exists('saved_opening_hours.journal')
+            store = SavedOpeningHours('saved_opening_hours')
+            assert len(list(store.items())) == 12
+            assert store.entry('00000A') == ('BUREAU 0', 'Mo 09:00-12:00')
+        finally:
+            os.chdir(cwd)
+    server.shutdown()
+
+def test_server_closes_idle_connections():
+    server, api = start_api()
+    StandInOsmApi.close_idle = True
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        try:
+            osc_files = write_changes(4)
+            # At 20 requests per second, the server has closed the previous connection before the next request
+            session = OsmApiSession(api, basic_authorization('bot', 'secret'), connections=2, rate=20)
+            journal = UploadJournal('changes/upload_journal')
+            assert upload(session, osc_files, journal, 2, '1.2.0', '2026-10-17') == 0
+            assert len(journal.uploaded) == 4
+            # Each changeset was uploaded exactly once, on a reopened connection
+            assert all(changeset['uploads'] == 1 and changeset['closed'] for changeset in StandInOsmApi.changesets.values())
+            session.close()
+        finally:
+            StandInOsmApi.close_idle = False
+            os.chdir(cwd)
+    server.shutdown()
+
+def test_authentication_failure():
+    server, api = start_api()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        try:
+            osc_files = write_changes(2)
+            session = OsmApiSession(api, bearer_authorization('wrong'), connections=2, rate=1000)
+            journal = UploadJournal('changes/upload_journal')
+            assert upload(session, osc_files, journal, 2, '1.2.0', '2026-10-17') == 2
+            assert len(journal.uploaded) == 0
+            assert commit(journal) == 0
+            assert not os.path.exists('saved_opening_hours.journal')
+            session.close()
+        finally:
+            os.chdir(cwd)
+    server.shutdown()
+
+if __name__ == '__main__':
+    run_tests(globals())
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# Tests for validate_opening_hours.py and its cache of the rules known to be valid
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import validate_opening_hours
+from validate_opening_hours import validate, rule_hash, cache_header
+from helpers import run_tests
+
+invalid_rule = 'BAD 09:00-12:00'
+
+# More distinct rules than min_parallel, so they are checked by worker processes
+def many_rules():
+    hours_dict = {}
+    for i in range(60):
+        hours_dict['{0:05d}A'.format(i)] = 'Mo-Fr 08:{0:02d}-12:00; PH off'.format(i)
+        hours_dict['{0:05d}B'.format(i)] = 'Sa 08:{0:02d}-12:00; PH off'.format(i)
+    hours_dict['99999A'] = invalid_rule
+    hours_dict['99999B'] = 'ERROR-0 Mo 09:00-12:00' # not ready, not checked
+    return hours_dict
+
+def run_validate(hours_dict, cache_file):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        errors = validate(hours_dict, {ref: 'BUREAU ' + ref for ref in hours_dict}, cache_file, jobs=2)
+    return errors, output.getvalue()
+
+def read_cache(cache_file):
+    with open(cache_file) as f:
+        lines = f.read().splitlines()
+    return lines[0], set(lines[1:])
+
+def test_parallel_check_and_cache():
+    assert len(many_rules()) - 2 >= validate_opening_hours.min_parallel
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_file = os.path.join(tmpdir, 'validated_opening_hours')
+        hours_dict = many_rules()
+        errors, output = run_validate(hours_dict, cache_file)
+        assert errors == 1
+        assert output == "ERROR: invalid opening hours for BUREAU 99999A: " + invalid_rule + "\n"
+        header, hashes = read_cache(cache_file)
+        assert header == cache_header()
+        assert hashes == set(rule_hash(hours) for hours in hours_dict.values() if hours != invalid_rule and 'ERROR' not in hours)
+
+        # The cached rules are not checked again: pretend the invalid rule was found valid before
+        with open(cache_file, 'a') as f:
+            f.write(rule_hash(invalid_rule) + '\n')
+        assert run_validate(hours_dict, cache_file) == (0, '')
+
+        # Rules no longer used are dropped from the cache
+        del hours_dict['00000A']
+        run_validate(hours_dict, cache_file)
+        header, hashes = read_cache(cache_file)
+        assert rule_hash('Mo-Fr 08:00-12:00; PH off') not in hashes
+        assert len(hashes) == 120
+
+def test_version_change():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_file = os.path.join(tmpdir, 'validated_opening_hours')
+        hours_dict = {'00001A': 'Mo-Fr 09:00-12:00; PH off', '00002A': invalid_rule}
+        with open(cache_file, 'w') as f:
+            f.write(cache_header() + '\n' + rule_hash(invalid_rule) + '\n')
+        assert run_validate(hours_dict, cache_file)[0] == 0
+
+        # Another KOpeningHours version: the whole cache is checked again, and rewritten
+        checker_version = validate_opening_hours.checker_version
+        validate_opening_hours.checker_version = lambda: 'another version'
+        try:
+            assert run_validate(hours_dict, cache_file)[0] == 1
+            assert read_cache(cache_file) == (cache_header(), {rule_hash('Mo-Fr 09:00-12:00; PH off')})
+        finally:
+            validate_opening_hours.checker_version = checker_version
+
+if __name__ == '__main__':
+    run_tests(globals())
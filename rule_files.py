@@ -0,0 +1,169 @@
+# Loader for the "ref|name|hours" files (data/new_opening_hours, saved_opening_hours, .hours files).
+# Many post offices share the same rule, so each distinct rule is stored only once,
+# and every office only points to it by index.
+# The parsed table is cached in a sidecar file (<file>.cache), reused as long as the file
+# has the same mtime and size, or failing that, the same content hash.
+import hashlib
+import os
+import pickle
+import sys
+from array import array
+
+cache_version = 1
+
+class RuleTable:
+    def __init__(self):
+        self.refs = []             # sorted office ids
+        self.names = []            # office names, same order as refs
+        self.rule_index = array('I') # index into self.rules, same order as refs
+        self.rules = []            # the distinct rules
+        self.invalid_lines = []
+        self.row = {}              # ref -> position in refs
+
+    def __len__(self):
+        return len(self.refs)
+
+    def __contains__(self, ref):
+        return ref in self.row
+
+    def hours(self, ref):
+        i = self.row.get(ref)
+        return None if i is None else self.rules[self.rule_index[i]]
+
+    def name(self, ref):
+        i = self.row.get(ref)
+        return None if i is None else self.names[i]
+
+    # (ref, name, hours) for all offices, sorted by ref
+    def items(self):
+        for i, ref in enumerate(self.refs):
+            yield ref, self.names[i], self.rules[self.rule_index[i]]
+
+    # dict-like views, for code that wants a ref -> hours or ref -> name mapping
+    def hours_dict(self):
+        return Column(self, self.hours)
+
+    def names_dict(self):
+        return Column(self, self.name)
+
+    def build_index(self):
+        self.row = {ref: i for i, ref in enumerate(self.refs)}
+
+    def __getstate__(self):
+        return (self.refs, self.names, self.rule_index, self.rules, self.invalid_lines)
+
+    def __setstate__(self, state):
+        self.refs, self.names, self.rule_index, self.rules, self.invalid_lines = state
+        self.build_index()
+
+class Column:
+    def __init__(self, table, getter):
+        self.table = table
+        self.getter = getter
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, ref):
+        return ref in self.table
+
+    def __getitem__(self, ref):
+        value = self.getter(ref)
+        if value is None:
+            raise KeyError(ref)
+        return value
+
+    def get(self, ref, default=None):
+        value = self.getter(ref)
+        return default if value is None else value
+
+    def keys(self):
+        return iter(self.table.refs)
+
+    __iter__ = keys
+
+    def items(self):
+        return ((ref, self.getter(ref)) for ref in self.table.refs)
+
+# Parse the file itself. Later lines win over earlier ones for the same ref.
+def parse(filename):
+    entries = {}
+    invalid_lines = []
+    with open(filename) as f:
+        for line in f:
+            data = [item.strip() for item in line.split('|', 2)]
+            if len(data) < 3:
+                invalid_lines.append(line)
+            else:
+                entries[data[0]] = (data[1], data[2])
+
+    table = RuleTable()
+    table.invalid_lines = invalid_lines
+    rule_ids = {}
+    table.refs = sorted(entries.keys())
+    for ref in table.refs:
+        name, hours = entries[ref]
+        table.names.append(sys.intern(name))
+        rule_id = rule_ids.get(hours)
+        if rule_id is None:
+            rule_id = rule_ids[hours] = len(table.rules)
+            table.rules.append(sys.intern(hours))
+        table.rule_index.append(rule_id)
+    table.build_index()
+    return table
+
+def file_hash(filename):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def read_cache(cache_file):
+    try:
+        with open(cache_file, 'rb') as f:
+            cached = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        return None
+    if cached.get('version') != cache_version:
+        return None
+    return cached
+
+def write_cache(cache_file, stamp, digest, table):
+    try:
+        with open(cache_file + '.new', 'wb') as f:
+            pickle.dump({'version': cache_version, 'stamp': stamp, 'hash': digest, 'table': table}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_file + '.new', cache_file)
+    except OSError as e:
+        print("WARNING: could not write " + cache_file + ": " + str(e))
+
+# Returns the RuleTable for the given file (empty if the file doesn't exist).
+# Invalid lines are reported on stdout, like the scripts always did.
+def load(filename, cache_file=None, report_invalid=True):
+    if not os.path.isfile(filename):
+        return RuleTable()
+    if cache_file is None:
+        cache_file = filename + '.cache'
+
+    st = os.stat(filename)
+    stamp = (st.st_mtime_ns, st.st_size)
+    table = None
+    cached = read_cache(cache_file) if cache_file else None
+    if cached is not None:
+        if cached['stamp'] == stamp:
+            table = cached['table']
+        else:
+            # Touched but maybe not modified (e.g. git checkout): compare the content
+            digest = file_hash(filename)
+            if cached['hash'] == digest:
+                table = cached['table']
+                write_cache(cache_file, stamp, digest, table)
+    if table is None:
+        table = parse(filename)
+        if cache_file:
+            write_cache(cache_file, stamp, file_hash(filename), table)
+
+    if report_invalid:
+        for line in table.invalid_lines:
+            print("ERROR: invalid line " + line)
+    return table
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Summarize data/events.jsonl (written by process_post_offices.py and filter_changes.py)
+# into the statistics lines of data/stats, in a single pass.
+import json
+import sys
+from collections import Counter
+
+filename = sys.argv[1] if len(sys.argv) > 1 else 'data/events.jsonl'
+
+# The records of each stage, from its last run only: a stage run again (e.g. filter_changes.py)
+# appends a new series of records, ending with its timing like the previous one
+runs = {}      # stage -> records of its last run
+finished = set() # stages whose last run wrote its timing
+with open(filename) as f:
+    for line in f:
+        record = json.loads(line)
+        stage = record['stage']
+        if stage in finished or stage not in runs:
+            runs[stage] = []
+            finished.discard(stage)
+        runs[stage].append(record)
+        if 'timing' in record:
+            finished.add(stage)
+
+decisions = Counter()
+duplicates = 0
+modified = 0
+chunks = []
+errors = []
+timings = []
+for stage, records in runs.items():
+    for record in records:
+        if 'decision' in record:
+            decisions[record['decision']] += 1
+            if record.get('duplicate'):
+                duplicates += 1
+            if record['changed']:
+                modified += 1
+        elif 'chunks' in record:
+            chunks.append(record)
+        elif 'error' in record:
+            errors.append((stage, record['error']))
+        elif 'timing' in record:
+            timings.append((stage, record['timing']))
+
+print(("{0} set because empty in OSM, {1} to be updated, {2} only missing 'PH off', {3} disagreements (skipped), {4} agreements, "
+       "{5} skipped because modified by a human, {6} blocked by covid hours (opening_hours empty), {7} not in datanova (wrong ref?), "
+       "{8} duplicate refs in OSM, {9} not ready (unresolved rules)").format(
+      decisions['added'] + decisions['covid_overridden'],
+      decisions['replaced'],
+      decisions['missing_ph_off'] + decisions['missing_ph_off_special_days'],
+      decisions['disagree'],
+      decisions['agree'] + decisions['old_special_days_removed'],
+      decisions['modified_meanwhile'],
+      decisions['covid_match'] + decisions['covid_blocked'],
+      decisions['not_in_datanova'],
+      duplicates,
+      decisions['not_ready']))
+print("{0} objects modified in total".format(modified))
+for record in chunks:
+    sizes = record['chunk_sizes']
+    print("{0}: {1} object(s) in {2} changeset(s), {3} to {4} objects each".format(
+          record['reason'] if record['reason'] != '' else 'new', record['objects'], record['chunks'], sizes[0], sizes[-1]))
+for stage, error in errors:
+    print("{0}: failed, {1}".format(stage, error))
+for stage, timing in timings:
+    print("{0}: {1:.2f}s wall, {2:.2f}s CPU, {3} MB peak memory".format(stage, timing['wall'], timing['cpu'], timing['max_rss_kb'] // 1024))
@@ -1,34 +1,10 @@
 #!/bin/sh
-password=`pass show osmbot-openstreetmap.org | head -n 1`
-date=`date +%Y-%m-%d`
-version=`cat ./version`
+# Upload all changes/*.osc files, then commit the successful ones to saved_opening_hours.
+# Running it again after an interruption only uploads what's left, see upload_changes.py
+# openstreetmap.org only accepts OAuth 2: the token of the bot account, see the README
+OSM_TOKEN=`pass show osmbot-openstreetmap.org-token | head -n 1`
+export OSM_TOKEN
 
-for changeset in changes/*.osc; do
-
-    comment="Import des opening_hours sur les bureaux de poste n'en ayant pas"
-    case $changeset in
-        */ph_off_special_days_*)
-            comment="Import des opening_hours: PH off et jours spécifiques manquant"
-            ;;
-        */ph_off_*)
-            comment="Import des opening_hours: PH off manquant"
-            ;;
-        */update_*)
-            comment="Mise à jour des opening_hours précédemment importés"
-            ;;
-    esac
-
-    url="https://wiki.openstreetmap.org/wiki/Import/FrenchPostOfficeOpeningHours"
-
-    python3 ../osm-bulk-upload/upload.py -u davidfaure_bot -p $password -c yes -m "$comment" $changeset \
-    -x "DataNovaImportScripts $version, via osm-bulk-upload/python.py" -y "datanova.laposte.fr, $date" -z "$url" -i
-    exitcode=$?
-
-    if [ $exitcode -eq 0 ]; then
-        # Success
-        hoursfile=`echo $changeset | sed -e 's/osc/hours/'`
-        ./commit_changes_locally.py $hoursfile || exit 1
-    fi
-done
+./upload_changes.py upload "$@" || exit 1
 
 echo "Done"
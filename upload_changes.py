@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# Upload the changesets from changes/*.osc to the OSM API, several at a time over a small pool
+# of keep-alive connections, then commit the matching .hours files to saved_opening_hours in one go.
+# Each successful upload is recorded in changes/upload_journal, so running it again after an
+# interruption only uploads the changesets that are left (and commits the ones not committed yet).
+import argparse
+import base64
+import datetime
+import glob
+import http.client
+import os
+import queue
+import select
+import sys
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import rule_files
+from opening_hours_store import SavedOpeningHours
+
+default_api = 'https://api.openstreetmap.org'
+default_journal = 'changes/upload_journal'
+wiki_url = 'https://wiki.openstreetmap.org/wiki/Import/FrenchPostOfficeOpeningHours'
+
+# Changeset comment, depending on the X-reason prefix of the file name (see filter_changes.py)
+def comment_for(osc_file):
+    name = os.path.basename(osc_file)
+    if name.startswith('ph_off_special_days_'):
+        return "Import des opening_hours: PH off et jours spécifiques manquant"
+    if name.startswith('ph_off_'):
+        return "Import des opening_hours: PH off manquant"
+    if name.startswith('update_'):
+        return "Mise à jour des opening_hours précédemment importés"
+    return "Import des opening_hours sur les bureaux de poste n'en ayant pas"
+
+# Same tags as upload_all.sh used to set with osm-bulk-upload's upload.py (-m, -x, -y, -z, and -i for import=yes)
+def changeset_tags(osc_file, version, date):
+    return {
+        'comment': comment_for(osc_file),
+        'created_by': 'DataNovaImportScripts {0}, via upload_changes.py'.format(version),
+        'source': 'datanova.laposte.fr, {0}'.format(date),
+        'url': wiki_url,
+        'import': 'yes',
+    }
+
+class ApiError(Exception):
+    def __init__(self, method, path, status, body):
+        super().__init__('{0} {1}: HTTP {2} {3}'.format(method, path, status, body.decode('utf-8', 'replace').strip()))
+        self.status = status
+
+# An idle keep-alive connection has nothing to read, unless the server closed it
+def is_closed_by_server(connection):
+    if connection.sock is None:
+        return False
+    readable, writable, errors = select.select([connection.sock], [], [], 0)
+    return len(readable) > 0
+
+# One HTTP(S) session to the OSM API: at most `connections` keep-alive connections,
+# shared by all threads, and at most `rate` requests per second.
+class OsmApiSession:
+    def __init__(self, api, authorization, connections=4, rate=2.0, timeout=300):
+        url = urllib.parse.urlsplit(api)
+        self.connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.host = url.netloc
+        self.prefix = url.path.rstrip('/')
+        self.authorization = authorization
+        self.timeout = timeout
+        self.pool = queue.LifoQueue()
+        for i in range(connections):
+            self.pool.put(None) # connected on first use
+        self.min_interval = 1.0 / rate if rate > 0 else 0
+        self.next_request = 0
+        self.lock = threading.Lock()
+
+    def wait_for_rate_limit(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_request)
+            self.next_request = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+    def send(self, connection, method, path, body):
+        headers = {'Authorization': self.authorization}
+        if body is not None:
+            headers['Content-Type'] = 'text/xml; charset=utf-8'
+        connection.request(method, self.prefix + path, body, headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    # Requests are never sent twice: creating a changeset or uploading into it is not idempotent,
+    # and after a disconnection we can't know whether the server handled the request.
+    # Instead, an idle connection the server already closed is reopened before sending.
+    def request(self, method, path, body=None):
+        self.wait_for_rate_limit()
+        connection = self.pool.get()
+        try:
+            if connection is None:
+                connection = self.connection_class(self.host, timeout=self.timeout)
+            elif is_closed_by_server(connection):
+                connection.close() # reconnects on the next request
+            status, data = self.send(connection, method, path, body)
+        except BaseException:
+            if connection is not None:
+                connection.close()
+            raise
+        finally:
+            self.pool.put(connection)
+        if status != 200:
+            raise ApiError(method, path, status, data)
+        return data
+
+    def close(self):
+        while not self.pool.empty():
+            connection = self.pool.get()
+            if connection is not None:
+                connection.close()
+
+# openstreetmap.org only accepts OAuth 2 tokens
+def bearer_authorization(token):
+    return 'Bearer ' + token
+
+# Only for dev/test servers still accepting HTTP Basic auth
+def basic_authorization(user, password):
+    return 'Basic ' + base64.b64encode((user + ':' + password).encode('utf-8')).decode('ascii')
+
+# The .osc file, with all objects moved into the given changeset
+def osc_for_changeset(osc_file, changeset_id):
+    root = ET.parse(osc_file).getroot()
+    for action in root:
+        for child in action:
+            child.set('changeset', changeset_id)
+    return ET.tostring(root, 'utf-8')
+
+# Create a changeset, upload the .osc file into it and close it. Returns the changeset id.
+def upload_one(session, osc_file, tags):
+    osm = ET.Element('osm')
+    changeset = ET.SubElement(osm, 'changeset')
+    for k, v in tags.items():
+        ET.SubElement(changeset, 'tag', {'k': k, 'v': v})
+    changeset_id = session.request('PUT', '/api/0.6/changeset/create', ET.tostring(osm, 'utf-8')).decode('ascii').strip()
+    try:
+        session.request('POST', '/api/0.6/changeset/' + changeset_id + '/upload', osc_for_changeset(osc_file, changeset_id))
+    except BaseException:
+        try:
+            session.request('PUT', '/api/0.6/changeset/' + changeset_id + '/close')
+        except (ApiError, http.client.HTTPException, OSError):
+            pass # it will be closed automatically after one hour anyway
+        raise
+    try:
+        session.request('PUT', '/api/0.6/changeset/' + changeset_id + '/close')
+    except (ApiError, http.client.HTTPException, OSError) as e:
+        print("WARNING: uploaded {0} but couldn't close changeset {1}: {2}".format(osc_file, changeset_id, e))
+    return changeset_id
+
+# "uploaded|<osc file>|<changeset id>" and "committed|<osc file>" lines, appended as we go
+class UploadJournal:
+    def __init__(self, filename):
+        self.filename = filename
+        self.uploaded = {}
+        self.committed = set()
+        self.lock = threading.Lock()
+        if os.path.isfile(filename):
+            with open(filename) as f:
+                for line in f:
+                    data = line.rstrip('\n').split('|')
+                    if data[0] == 'uploaded' and len(data) == 3:
+                        self.uploaded[data[1]] = data[2]
+                    elif data[0] == 'committed' and len(data) == 2:
+                        self.committed.add(data[1])
+
+    def record(self, lines):
+        with self.lock:
+            with open(self.filename, 'a') as f:
+                f.writelines('|'.join(fields) + '\n' for fields in lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def add_uploaded(self, osc_file, changeset_id):
+        self.record([('uploaded', osc_file, changeset_id)])
+        self.uploaded[osc_file] = changeset_id
+
+    def add_committed(self, osc_files):
+        self.record([('committed', osc_file) for osc_file in osc_files])
+        self.committed.update(osc_files)
+
+    def not_committed(self):
+        return sorted(osc_file for osc_file in self.uploaded if osc_file not in self.committed)
+
+# Upload one changeset and record it in the journal right away, from the worker thread,
+# so that it is recorded even if the main thread is interrupted meanwhile
+def upload_and_record(session, osc_file, tags, journal):
+    changeset_id = upload_one(session, osc_file, tags)
+    journal.add_uploaded(osc_file, changeset_id)
+    return changeset_id
+
+# Returns the number of changesets that failed to upload
+def upload(session, osc_files, journal, jobs, version, date):
+    pending = [osc_file for osc_file in osc_files if osc_file not in journal.uploaded]
+    if len(pending) < len(osc_files):
+        print("{0} changesets already uploaded, skipping them".format(len(osc_files) - len(pending)))
+    failures = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(upload_and_record, session, osc_file, changeset_tags(osc_file, version, date), journal): osc_file
+                   for osc_file in pending}
+        try:
+            for future in as_completed(futures):
+                osc_file = futures[future]
+                try:
+                    changeset_id = future.result()
+                except (ApiError, http.client.HTTPException, OSError, ET.ParseError) as e:
+                    print("ERROR: failed to upload {0}: {1}".format(osc_file, e))
+                    failures += 1
+                    continue
+                print("Uploaded {0} as changeset {1}".format(osc_file, changeset_id))
+        except BaseException:
+            # Interrupted: don't start the uploads still waiting, let the running ones finish
+            executor.shutdown(cancel_futures=True)
+            raise
+    return failures
+
+# Commit the .hours files of all uploaded changesets in one batch, like commit_changes_locally.py
+def commit(journal, db='saved_opening_hours', new_hours='data/new_opening_hours'):
+    osc_files = journal.not_committed()
+    if len(osc_files) == 0:
+        return 0
+    store = SavedOpeningHours(db)
+    store.commit([os.path.splitext(osc_file)[0] + '.hours' for osc_file in osc_files])
+    # Always merge the journal back, so that the saved_opening_hours tracked by git is current
+    store.compact(rule_files.load(new_hours, report_invalid=False).names_dict())
+    journal.add_committed(osc_files)
+    print("Committed {0} changesets to {1}".format(len(osc_files), db))
+    return len(osc_files)
+
+def read_version():
+    version_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'version')
+    with open(version_file) as f:
+        return f.read().strip()
+
+def main():
+    parser = argparse.ArgumentParser(description='Upload the changesets to OSM and commit them to saved_opening_hours')
+    parser.add_argument('--journal', default=default_journal)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    upload_parser = subparsers.add_parser('upload', help='upload the changesets, then commit them')
+    upload_parser.add_argument('--api', default=default_api, help='OSM API server (default: ' + default_api + ')')
+    upload_parser.add_argument('--user', help='OSM user name for HTTP Basic auth on a dev/test server, the password is taken from $OSM_PASSWORD '
+                                              '(default: the OAuth 2 token from $OSM_TOKEN)')
+    upload_parser.add_argument('-j', '--jobs', type=int, default=4, help='number of changesets uploaded at the same time (default: 4)')
+    upload_parser.add_argument('--rate', type=float, default=2.0, help='max number of API requests per second (default: 2)')
+    upload_parser.add_argument('--no-commit', action='store_true', help="don't commit to saved_opening_hours afterwards")
+    upload_parser.add_argument('files', nargs='*', help='.osc files (default: changes/*.osc)')
+    subparsers.add_parser('commit', help='only commit the changesets uploaded but not committed yet')
+    args = parser.parse_args()
+
+    journal = UploadJournal(args.journal)
+    failures = 0
+    if args.command == 'upload':
+        if args.user:
+            if args.api == default_api:
+                sys.stderr.write("ERROR: " + default_api + " doesn't accept --user (HTTP Basic auth), set $OSM_TOKEN instead\n")
+                sys.exit(1)
+            if 'OSM_PASSWORD' not in os.environ:
+                sys.stderr.write("ERROR: --user needs $OSM_PASSWORD\n")
+                sys.exit(1)
+            authorization = basic_authorization(args.user, os.environ['OSM_PASSWORD'])
+        elif 'OSM_TOKEN' in os.environ:
+            authorization = bearer_authorization(os.environ['OSM_TOKEN'])
+        else:
+            sys.stderr.write("ERROR: set $OSM_TOKEN to an OAuth 2 token of the upload account\n")
+            sys.exit(1)
+        osc_files = args.files or sorted(glob.glob('changes/*.osc'))
+        session = OsmApiSession(args.api, authorization, args.jobs, args.rate)
+        try:
+            failures = upload(session, osc_files, journal, args.jobs, read_version(), datetime.date.today().isoformat())
+        finally:
+            session.close()
+            # Even when interrupted, commit what was uploaded, so that it's not lost if changes/ is regenerated
+            if not args.no_commit:
+                commit(journal)
+        if args.no_commit:
+            sys.exit(1 if failures > 0 else 0)
+    else:
+        commit(journal)
+    if failures > 0:
+        print("{0} changesets failed, run again to retry them".format(failures))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# Check the opening_hours rules generated by parse.pl with KOpeningHours.
+# Each distinct rule is only checked once, rules that are not in the cache yet
+# are checked in parallel, and the rules found valid are remembered in a cache
+# file (one hash per line) so that the next run only checks the new rules.
+# The first line of the cache is the KOpeningHours version it was built with: a new version may
+# accept or normalize rules differently, so the whole cache is thrown away when it changes.
+import hashlib
+import importlib.metadata
+import os
+import sys
+import rule_files
+from concurrent.futures import ProcessPoolExecutor
+import PyKOpeningHours.PyKOpeningHours
+from PyKOpeningHours.PyKOpeningHours import OpeningHours, Error
+
+default_cache = 'data/validated_opening_hours'
+
+# Below this number of rules to check, starting worker processes costs more than it saves
+min_parallel = 64
+
+# Bump when the meaning of the cached hashes changes
+cache_format = 2
+
+# The installed PyKOpeningHours version, or the hash of the binding itself when it was built from source
+def checker_version():
+    try:
+        return importlib.metadata.version('PyKOpeningHours')
+    except importlib.metadata.PackageNotFoundError:
+        with open(PyKOpeningHours.PyKOpeningHours.__file__, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+def cache_header():
+    return 'format {0} KOpeningHours {1}'.format(cache_format, checker_version())
+
+def rule_hash(hours):
+    return hashlib.sha1(hours.encode('utf-8')).hexdigest()
+
+# Returns None if the rule is valid and already normalized,
+# otherwise the normalized rule, or '' for a syntax error
+def check_rule(hours):
+    parser = OpeningHours()
+    parser.setExpression(hours)
+    if parser.error() == Error.SyntaxError or parser.error() == Error.IncompatibleMode:
+        return ''
+    new_oh = parser.normalizedExpression()
+    if new_oh != hours:
+        return new_oh
+    return None
+
+def load_cache(cache_file, header):
+    if not os.path.isfile(cache_file):
+        return set()
+    with open(cache_file) as f:
+        if f.readline().rstrip('\n') != header:
+            return set()
+        return set(line.strip() for line in f)
+
+def save_cache(cache_file, header, hashes):
+    with open(cache_file + ".new", "w") as f:
+        f.write(header + "\n")
+        for h in sorted(hashes):
+            f.write(h + "\n")
+    os.rename(cache_file + ".new", cache_file)
+
+# hours_dict: office id -> rule, office_names: office id -> name
+# Prints all invalid or non-normalized rules, and returns the number of such offices
+def validate(hours_dict, office_names, cache_file=default_cache, jobs=None):
+    # Group offices by rule, so each rule is only checked once
+    offices_for_rule = {}
+    for id, hours in hours_dict.items():
+        if not 'ERROR' in hours:
+            offices_for_rule.setdefault(hours, []).append(id)
+
+    header = cache_header()
+    cached_hashes = load_cache(cache_file, header)
+    hashes = {hours: rule_hash(hours) for hours in offices_for_rule}
+    unseen = [hours for hours, h in hashes.items() if h not in cached_hashes]
+    # Only keep the rules still in use, so the cache doesn't grow forever
+    valid_hashes = set(h for h in hashes.values() if h in cached_hashes)
+
+    if len(unseen) < min_parallel:
+        results = [check_rule(hours) for hours in unseen]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(check_rule, unseen, chunksize=max(1, len(unseen) // (4 * (jobs or os.cpu_count() or 1)))))
+
+    errors = 0
+    for hours, new_oh in zip(unseen, results):
+        if new_oh is None:
+            valid_hashes.add(hashes[hours])
+            continue
+        for id in sorted(offices_for_rule[hours]):
+            if new_oh == '':
+                print("ERROR: invalid opening hours for {0}: {1}".format(office_names[id], hours))
+            else:
+                print("WARNING: {0}: KOpeningHours normalized {1} to {2}".format(office_names[id], hours, new_oh))
+            errors += 1
+
+    if valid_hashes != cached_hashes:
+        save_cache(cache_file, header, valid_hashes)
+    return errors
+
+if __name__ == '__main__':
+    table = rule_files.load(sys.argv[1] if len(sys.argv) > 1 else 'data/new_opening_hours')
+    sys.exit(1 if validate(table.hours_dict(), table.names_dict()) > 0 else 0)